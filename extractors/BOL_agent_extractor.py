@@ -1,116 +1,398 @@
-import json
+import os
+import logging
+import re
+import time
+import zlib
+import orjson
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+import httpx
+import numpy as np
 import streamlit as st
 from typing import List, Optional
 
-from openai import OpenAI
+from openai import OpenAI, DefaultHttpxClient
+from pydantic import BaseModel, ConfigDict, Field
+
+logger = logging.getLogger(__name__)
 
 # --- Configuration ---
 OPENAI_MODEL = "gpt-4.1-mini"  # or "gpt-4.1", etc.
+# Deterministic, bounded generations: stable output for caching and a cap on latency
+GENERATION_PARAMS = {"temperature": 0, "top_p": 1, "seed": 42, "max_tokens": 512}
+BOL_CACHE_PATH = os.getenv("BOL_CACHE_PATH", ".bol_agent_cache.sqlite3")
+EMBEDDING_MODEL = "text-embedding-3-small"
+# The semantic cache is opt-in: two BOLs on the same carrier template can embed
+# very closely while carrying different numbers.
+SEMANTIC_CACHE_ENABLED = os.getenv("BOL_SEMANTIC_CACHE", "0") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("BOL_SEMANTIC_CACHE_THRESHOLD", "0.95"))
+# HTTP/2 lets concurrent requests multiplex over a few kept-alive connections
+_HTTP_LIMITS = httpx.Limits(max_connections=200, max_keepalive_connections=100, keepalive_expiry=60)
+
+_WHITESPACE_RE = re.compile(r"[ \t\f\v]+")
+# Container numbers (owner code, serial, check digit), tolerating OCR spacing
+_CONTAINER_RE = re.compile(r"\b([A-Z]{4})\s?(\d{6})\s?-?\s?(\d)\b")
+# Lines worth sending to the model: carton / mass totals (plus container rows)
+_KEY_LINE_RE = re.compile(
+    r"(?i)\b(kgs?|kilos?|cartons?|ctns?|packages?|pkgs?|nett?|gross|weight|mass)\b"
+)
+_DIGITS_RE = re.compile(r"\d+")
 
 
-# --- 1. Define the Function Schema (Tool) & Optional Local Impl ---
+# --- 0. Response Cache ---
 
-def submit_extracted_bol_data(
-    container_number: Optional[List[str]] = None,
-    total_cartons: Optional[int] = None,
-    total_gross_mass_kg: Optional[float] = None,
-    total_nett_mass_kg: Optional[float] = None,
-):
+def normalize_ocr_text(ocr_text: str) -> str:
     """
-    Submits the extracted data from a Bill of Lading document.
+    NFC-normalizes the OCR text, collapses runs of spaces and drops blank lines,
+    so that re-OCR'd copies of the same document produce the same prompt.
+    """
+    text = unicodedata.normalize("NFC", ocr_text or "")
+    lines = (_WHITESPACE_RE.sub(" ", line).strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
 
-    Args:
-        container_number (Optional[List[str]]): A list of all unique container numbers found.
-        total_cartons (Optional[int]): The total number of cartons or packages.
-        total_gross_mass_kg (Optional[float]): The total gross weight in kilograms (KGS).
-        total_nett_mass_kg (Optional[float]): The total nett (net) weight in kilograms (KG).
-    
-    Returns:
-        A dictionary confirming the data that was received.
+# ISO 6346 letter values: 10 upwards, skipping multiples of 11
+_ISO6346_LETTER_VALUES = dict(zip(
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZ",
+    (v for v in range(10, 39) if v % 11),
+))
+
+
+def is_valid_container_number(code: str) -> bool:
+    """Checks the ISO 6346 check digit of an 11-character container number."""
+    total = sum(
+        (_ISO6346_LETTER_VALUES[ch] if ch.isalpha() else int(ch)) << i
+        for i, ch in enumerate(code[:10])
+    )
+    return total % 11 % 10 == int(code[10])
+
+
+def extract_container_numbers(text: str) -> Optional[List[str]]:
+    """
+    Finds the unique container numbers in the text, in order of appearance,
+    keeping only those with a valid ISO 6346 check digit.
     """
-    extracted_data = {
-        "container_number": container_number,
-        "total_cartons": total_cartons,
-        "total_gross_mass_kg": total_gross_mass_kg,
-        "total_nett_mass_kg": total_nett_mass_kg,
-    }
-    print("--- Python Function 'submit_extracted_bol_data' was successfully called! ---")
-    return extracted_data
+    found = dict.fromkeys("".join(match.groups()) for match in _CONTAINER_RE.finditer(text))
+    containers = [code for code in found if is_valid_container_number(code)]
+    return containers or None
 
 
-# OpenAI tool (function) schema corresponding to submit_extracted_bol_data
-TOOLS = [
-    {
-        "type": "function",
-        "function": {
-            "name": "submit_extracted_bol_data",
-            "description": "Submits the extracted data from a Bill of Lading document.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "container_number": {
-                        "type": "array",
-                        "items": {"type": "string"},
-                        "description": "A list of all unique container numbers found.",
-                    },
-                    "total_cartons": {
-                        "type": "integer",
-                        "description": "The total number of cartons or packages.",
-                    },
-                    "total_gross_mass_kg": {
-                        "type": "number",
-                        "description": "The total gross weight in kilograms (KGS).",
-                    },
-                    "total_nett_mass_kg": {
-                        "type": "number",
-                        "description": "The total net weight in kilograms (KGS).",
-                    },
-                },
-                "required": [],
-            },
-        },
-    }
-]
+def compact_ocr_text(normalized_text: str, context: int = 1) -> str:
+    """
+    Keeps only the lines the model needs (container numbers, carton and mass
+    lines) plus `context` lines either side, to shrink the prompt.
+    Falls back to the full text if nothing matches.
+    """
+    lines = normalized_text.splitlines()
+    keep = set()
+    for i, line in enumerate(lines):
+        if _CONTAINER_RE.search(line) or _KEY_LINE_RE.search(line):
+            keep.update(range(max(0, i - context), min(len(lines), i + context + 1)))
+    if not keep:
+        return normalized_text
+    return "\n".join(lines[i] for i in sorted(keep))
 
 
-def run_bol_extraction_agent(
-    ocr_text: str,
-) -> Optional[dict]:
+class BolCache:
     """
-    Initializes the AI agent (ChatGPT) and runs the data extraction process.
+    Exact-match, disk-backed cache of agent responses.
+    Keys are a SHA-256 of everything that determines the model's answer
+    (model, prompts and schema); values are the zlib-compressed arguments JSON.
     """
 
-    print("\n--- Inside run_bol_extraction_agent (OpenAI / ChatGPT version) ---")
+    def __init__(self, path: str = BOL_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS bol_cache (key TEXT PRIMARY KEY, args_json BLOB, ts INTEGER)"
+        )
+        self._conn.commit()
 
-    # --- Init OpenAI client ---
-    # You can also rely on OPENAI_API_KEY env var instead of st.secrets if you prefer.
-    client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+    @staticmethod
+    def make_key(**parts) -> str:
+        return hashlib.sha256(orjson.dumps(parts, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT args_json FROM bol_cache WHERE key = ?", (key,)).fetchone()
+        return zlib.decompress(row[0]).decode("utf-8") if row else None
+
+    def put(self, key: str, args_json: str) -> None:
+        blob = zlib.compress(args_json.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO bol_cache (key, args_json, ts) VALUES (?, ?, ?)",
+                (key, blob, int(time.time())),
+            )
+            self._conn.commit()
+
+
+_cache: Optional[BolCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_bol_cache() -> BolCache:
+    """Returns the process-wide BolCache, opening it on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = BolCache()
+    return _cache
+
+
+def _cache_get(key: str) -> Optional[str]:
+    """Looks the key up in the BolCache; a cache error is logged and treated as a miss."""
+    try:
+        return get_bol_cache().get(key)
+    except sqlite3.Error as e:
+        logger.warning("BOL cache lookup failed, continuing without it: %s", e)
+        return None
+
+
+def _cache_put(key: str, args_json: str) -> None:
+    """Stores a response in the BolCache; a cache error is logged and otherwise ignored."""
+    try:
+        get_bol_cache().put(key, args_json)
+    except sqlite3.Error as e:
+        logger.warning("Could not write to the BOL cache: %s", e)
+
+
+def digits_key(normalized_text: str) -> str:
+    """Hashes the sequence of digit runs in the text, i.e. every number it carries."""
+    return hashlib.sha256(orjson.dumps(_DIGITS_RE.findall(normalized_text))).hexdigest()
+
+
+class SemanticBolCache:
+    """
+    Near-duplicate cache of agent responses, for re-scans of the same BOL whose
+    OCR text differs slightly. Stores L2-normalized embeddings of the OCR text
+    next to the response and does a brute-force inner-product search in memory.
+    Only rows whose text carries exactly the same numbers (see digits_key) are
+    candidates, so a same-template BOL with other totals can never match.
+    Rows are tagged with the agent configuration digest and only rows written
+    under `config` are loaded, so a model, prompt or embedding change starts afresh.
+    """
+
+    def __init__(self, config: str, path: str = BOL_CACHE_PATH, threshold: float = SEMANTIC_CACHE_THRESHOLD):
+        self.config = config
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS bol_semantic_cache "
+            "(id INTEGER PRIMARY KEY, embedding BLOB, args_json BLOB, ts INTEGER, config TEXT, digits TEXT)"
+        )
+        # Tables created before these columns existed; their rows stay untagged and unused
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(bol_semantic_cache)")}
+        for column in ("config", "digits"):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE bol_semantic_cache ADD COLUMN {column} TEXT")
+        self._conn.commit()
+        rows = self._conn.execute(
+            "SELECT embedding, args_json, digits FROM bol_semantic_cache WHERE config = ? ORDER BY id", (config,)
+        ).fetchall()
+        self._matrix = (
+            np.vstack([np.frombuffer(row[0], dtype=np.float32) for row in rows])
+            if rows else None
+        )
+        self._values = [row[1] for row in rows]
+        self._digits = [row[2] for row in rows]
+
+    @staticmethod
+    def embed(client: OpenAI, text: str) -> np.ndarray:
+        response = client.embeddings.create(model=EMBEDDING_MODEL, input=text)
+        vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def search(self, embedding: np.ndarray, digits: str) -> Optional[str]:
+        with self._lock:
+            candidates = [i for i, row_digits in enumerate(self._digits) if row_digits == digits]
+            if not candidates:
+                return None
+            scores = self._matrix[candidates] @ embedding
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            logger.info("Semantic cache hit (cosine similarity %.3f).", scores[best])
+            return zlib.decompress(self._values[candidates[best]]).decode("utf-8")
+
+    def put(self, embedding: np.ndarray, digits: str, args_json: str) -> None:
+        blob = zlib.compress(args_json.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO bol_semantic_cache (embedding, args_json, ts, config, digits) VALUES (?, ?, ?, ?, ?)",
+                (embedding.astype(np.float32).tobytes(), blob, int(time.time()), self.config, digits),
+            )
+            self._conn.commit()
+            row = embedding[np.newaxis, :]
+            self._matrix = row if self._matrix is None else np.vstack([self._matrix, row])
+            self._values.append(blob)
+            self._digits.append(digits)
+
+
+_semantic_cache: Optional[SemanticBolCache] = None
+
+
+def get_semantic_bol_cache() -> SemanticBolCache:
+    """Returns the process-wide SemanticBolCache, loading it on first use."""
+    global _semantic_cache
+    if _semantic_cache is None:
+        with _cache_lock:
+            if _semantic_cache is None:
+                _semantic_cache = SemanticBolCache(config=_AGENT_CONFIG_DIGEST)
+    return _semantic_cache
+
+
+# --- 1. Define the Response Schema ---
 
-    # --- Prompt (role & instructions) ---
-    system_prompt = (
-        "You are an expert data extraction agent specializing in logistics and "
-        "shipping documents. Your job is to carefully extract structured data "
-        "from Bill of Lading (BOL) text."
+class BolData(BaseModel):
+    """
+    Validated shape of the agent's BOL extraction.
+    Also the source of the strict JSON schema sent to the model: every field is
+    required (strict mode needs that) and absent values come back as null.
+    Container numbers are not asked of the model; they are extracted locally.
+    """
+    model_config = ConfigDict(extra="forbid")
+
+    total_cartons: Optional[int] = Field(description="The total number of cartons or packages.")
+    total_gross_mass_kg: Optional[float] = Field(description="The total gross weight in kilograms (KGS).")
+    total_nett_mass_kg: Optional[float] = Field(description="The total net weight in kilograms (KGS).")
+
+
+BOL_RESPONSE_SCHEMA = BolData.model_json_schema()
+
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "extracted_bol_data",
+        "strict": True,
+        "schema": BOL_RESPONSE_SCHEMA,
+    },
+}
+
+
+# --- 2. Client & Prompts (built once per process) ---
+
+@st.cache_resource(show_spinner=False)
+def _openai_client() -> OpenAI:
+    """OpenAI client shared by all sessions, so its connection pool is reused process-wide."""
+    # You can also rely on OPENAI_API_KEY env var instead of st.secrets if you prefer.
+    return OpenAI(
+        api_key=st.secrets["OPENAI_API_KEY"],
+        http_client=DefaultHttpxClient(http2=True, limits=_HTTP_LIMITS),
     )
 
-    user_prompt = f"""
-Analyze the following document text and call the `submit_extracted_bol_data` function
-with the extracted values.
 
-Extraction Rules:
-- container_number: Find all unique 11-character alphanumeric container numbers
-  (format: 4 letters, 7 numbers). Return a list of strings.
+_SYSTEM_PROMPT = (
+    "You are an expert data extraction agent specializing in logistics and "
+    "shipping documents. Your job is to carefully extract structured data "
+    "from Bill of Lading (BOL) text."
+)
+
+_EXTRACTION_RULES = """Extraction Rules:
 - total_cartons: Find the total number of cartons or packages. Return an integer.
 - total_gross_mass_kg: Find the total gross weight in Kilograms (KGS). Return a float.
 - total_nett_mass_kg: Find the total net weight in Kilograms (KGS). Return a float.
-- Use null for any field that cannot be found.
+- Use null for any field that cannot be found."""
+
+USER_PROMPT_TMPL = (
+    "Analyze the following document text and return the extracted values as JSON.\n\n"
+    + _EXTRACTION_RULES
+    + "\n\n--- DOCUMENT TEXT TO ANALYZE ---\n{ocr_text}\n--- END OF DOCUMENT ---"
+)
 
---- DOCUMENT TEXT TO ANALYZE ---
-{ocr_text}
---- END OF DOCUMENT ---
-    """.strip()
 
-    print("\nSending prompt and document text to ChatGPT...")
+# Digest of the per-process request configuration (model, schema, generation
+# params, prompts, embedding model), serialized once here instead of on every
+# cache-key computation.
+_AGENT_CONFIG_DIGEST = hashlib.sha256(orjson.dumps(
+    {
+        "model": OPENAI_MODEL,
+        "schema": RESPONSE_FORMAT,
+        "params": GENERATION_PARAMS,
+        "system": _SYSTEM_PROMPT,
+        "user": USER_PROMPT_TMPL,
+        "embedding_model": EMBEDDING_MODEL,
+    },
+    option=orjson.OPT_SORT_KEYS,
+)).hexdigest()
+
+
+def _build_bol_prompts(ocr_text: str) -> tuple:
+    """Returns (system_prompt, user_prompt, normalized_text) for one BOL."""
+    normalized_text = normalize_ocr_text(ocr_text)
+    user_prompt = USER_PROMPT_TMPL.format(ocr_text=compact_ocr_text(normalized_text))
+    return _SYSTEM_PROMPT, user_prompt, normalized_text
+
+
+def _response_json(response) -> Optional[str]:
+    """Returns the structured-output JSON from the model's response, or None on a refusal."""
+    # A changed fingerprint means the backend changed, which can invalidate cached answers
+    logger.info("Model fingerprint: %s", response.system_fingerprint)
+    message = response.choices[0].message
+    if message.refusal:
+        logger.error("Model refused the request: %s", message.refusal)
+        return None
+
+    logger.info("ChatGPT returned the structured extraction.")
+    return message.content
+
+
+def _cached_bol_data(args_json: str) -> Optional[dict]:
+    """
+    Re-validates a cached response against BolData, dropping keys the schema no
+    longer has (older entries also stored container_number). Returns None if the
+    entry does not validate, so the caller treats it as a miss.
+    """
+    try:
+        data = orjson.loads(args_json)
+        data = {key: value for key, value in data.items() if key in BolData.model_fields}
+        return BolData.model_validate(data).model_dump()
+    except Exception as e:
+        logger.warning("Ignoring an invalid cached BOL extraction: %s", e)
+        return None
+
+
+def run_bol_extraction_agent(
+    ocr_text: str,
+) -> Optional[dict]:
+    """
+    Initializes the AI agent (ChatGPT) and runs the data extraction process.
+    """
+
+    logger.info("Running BOL extraction agent (OpenAI / ChatGPT version).")
+
+    client = _openai_client()
+
+    system_prompt, user_prompt, normalized_text = _build_bol_prompts(ocr_text)
+    containers = extract_container_numbers(normalized_text)
+
+    cache_key = BolCache.make_key(config=_AGENT_CONFIG_DIGEST, system=system_prompt, user=user_prompt)
+    cached_args = _cache_get(cache_key)
+    cached_data = _cached_bol_data(cached_args) if cached_args is not None else None
+    if cached_data is not None:
+        logger.info("Returning cached BOL extraction (no API call made).")
+        return {"container_number": containers, **cached_data}
+
+    embedding = None
+    if SEMANTIC_CACHE_ENABLED:
+        digits = digits_key(normalized_text)
+        try:
+            embedding = SemanticBolCache.embed(client, normalized_text)
+            # A near match is not this document's answer, so it is not copied into the exact cache
+            cached_args = get_semantic_bol_cache().search(embedding, digits)
+            cached_data = _cached_bol_data(cached_args) if cached_args is not None else None
+            if cached_data is not None:
+                return {"container_number": containers, **cached_data}
+        except Exception as e:
+            logger.warning("Semantic cache lookup failed, continuing without it: %s", e)
+            embedding = None
+
+    logger.info("Sending prompt and document text to ChatGPT...")
 
     try:
         response = client.chat.completions.create(
@@ -119,39 +401,27 @@ Extraction Rules:
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt},
             ],
-            tools=TOOLS,
-            # Force the model to call this specific function
-            tool_choice={
-                "type": "function",
-                "function": {"name": "submit_extracted_bol_data"},
-            },
+            response_format=RESPONSE_FORMAT,
+            **GENERATION_PARAMS,
         )
 
-        message = response.choices[0].message
-
-        if not message.tool_calls:
-            print("ERROR: Model did not call any tool.")
-            return None
-
-        tool_call = message.tool_calls[0]
-        func_name = tool_call.function.name
-        args_json = tool_call.function.arguments
-
-        if func_name != "submit_extracted_bol_data":
-            print(f"ERROR: Unexpected function called: {func_name}")
+        args_json = _response_json(response)
+        if args_json is None:
             return None
 
-        print(f"SUCCESS: ChatGPT successfully called '{func_name}'.\n")
-
-        # Parse JSON arguments from the tool call
-        final_data = json.loads(args_json)
-
-        # Optional: actually invoke the local Python function as well
-        submit_extracted_bol_data(**final_data)
-
-        return final_data
+        # Parse the schema-validated JSON response
+        final_data = {"container_number": containers, **BolData.model_validate_json(args_json).model_dump()}
 
     except Exception as e:
-        print("ERROR: Failed to get a valid function call from the model.")
-        print(f"Details: {e}")
+        logger.error("Failed to get a valid structured response from the model: %s", e)
         return None
+
+    # Caching is best-effort: a failed write must not lose a good extraction
+    _cache_put(cache_key, args_json)
+    if embedding is not None:
+        try:
+            get_semantic_bol_cache().put(embedding, digits, args_json)
+        except Exception as e:
+            logger.warning("Could not write to the semantic BOL cache: %s", e)
+
+    return final_data
@@ -1,29 +1,149 @@
 from typing import Optional, Dict, List, Tuple
+import bisect
+import logging
+import os
 import re
 
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Only search the first page for the geometric fields (vessel/voyage and port of
+# destination already do). Off by default so multi-page BOLs keep searching every page.
+_USE_FIRST_PAGE_ONLY = os.getenv("BOL_FIRST_PAGE_ONLY", "0") == "1"
+
 
 def get_text(text_anchor: dict, text: str) -> str:
     """
     Document AI's text anchor maps to a part of the full text.
     This function extracts that part of the text.
     """
-    if not text_anchor.text_segments:
+    segments = text_anchor.text_segments
+    if not segments:
         return ""
     
     # The text is stored in segments. Join them together.
     # The Form Parser typically only has one segment.
-    start_index = int(text_anchor.text_segments[0].start_index)
-    end_index = int(text_anchor.text_segments[0].end_index)
+    segment = segments[0]
+    start_index = int(segment.start_index)
+    end_index = int(segment.end_index)
     
     return text[start_index:end_index]
 
 
+def _bbox_tuple(vs) -> Tuple[float, float, float, float, float, float]:
+    """Returns (min_x, min_y, max_x, max_y, center_x, center_y) for a line's normalized vertices."""
+    if len(vs) == 4:
+        # Line polygons are quads: unpack them directly rather than building lists.
+        # All four corners are still compared, since skewed scans are not axis-aligned.
+        v0, v1, v2, v3 = vs
+        x0, x1, x2, x3 = v0.x, v1.x, v2.x, v3.x
+        y0, y1, y2, y3 = v0.y, v1.y, v2.y, v3.y
+        min_x, max_x = min(x0, x1, x2, x3), max(x0, x1, x2, x3)
+        min_y, max_y = min(y0, y1, y2, y3), max(y0, y1, y2, y3)
+    else:
+        xs = [v.x for v in vs]
+        ys = [v.y for v in vs]
+        min_x, max_x = min(xs), max(xs)
+        min_y, max_y = min(ys), max(ys)
+    return (min_x, min_y, max_x, max_y, (min_x + max_x) / 2.0, (min_y + max_y) / 2.0)
+
+
+class PageCtx:
+    """
+    Per-page view used by the geometric helpers below. Line texts and
+    bounding boxes are computed once here instead of on every anchor/value pass.
+    The bounding boxes are also kept as NumPy columns (min_x ... cy) so region
+    filters can run as vectorised masks, and as line indices sorted by top
+    edge and by vertical centre so "below" / "same row" lookups can bisect.
+    Resolved anchor lines and header values are memoised in `anchors` and
+    `values`, keyed by lowercased keyword; any `anchor_keywords` passed in are
+    resolved during the same walk over the lines.
+    """
+    __slots__ = (
+        "page", "lines", "raw_texts", "texts", "texts_lower", "bboxes",
+        "min_x", "min_y", "max_x", "max_y", "cx", "cy",
+        "order_by_min_y", "min_y_sorted", "order_by_cy", "cy_sorted",
+        "anchors", "values",
+    )
+
+    def __init__(self, page, document_text: str, anchor_keywords=()):
+        self.page = page
+        lines = self.lines = list(page.lines)
+        raw_texts = self.raw_texts = []
+        texts = self.texts = []
+        texts_lower = self.texts_lower = []
+        vertex_lists = []
+        anchor_keywords = list(dict.fromkeys(anchor_keywords))
+        hits: Dict[str, List[int]] = {kw: [] for kw in anchor_keywords}
+        active = list(anchor_keywords)
+        # One walk over the lines, reading each line's layout only once
+        for i, line in enumerate(lines):
+            layout = line.layout
+            raw_text = get_text(layout.text_anchor, document_text)
+            text = raw_text.strip()
+            text_lower = text.lower()
+            raw_texts.append(raw_text)
+            texts.append(text)
+            texts_lower.append(text_lower)
+            vertex_lists.append(layout.bounding_poly.normalized_vertices)
+            if text_lower and active:
+                for kw in active:
+                    if kw in text_lower:
+                        hits[kw].append(i)
+                # An exact header line always wins, so stop looking for that keyword
+                if text_lower in active:
+                    active.remove(text_lower)
+        if all(len(vs) == 4 for vs in vertex_lists):
+            # Pack every quad into one (N, 4, 2) array and reduce the whole page at once
+            coords = np.fromiter(
+                (c for vs in vertex_lists for v in vs for c in (v.x, v.y)),
+                dtype=np.float64, count=8 * len(vertex_lists),
+            ).reshape(-1, 4, 2)
+            mins = coords.min(axis=1)
+            maxs = coords.max(axis=1)
+            columns = np.stack((
+                mins[:, 0], mins[:, 1], maxs[:, 0], maxs[:, 1],
+                (mins[:, 0] + maxs[:, 0]) / 2, (mins[:, 1] + maxs[:, 1]) / 2,
+            ))
+            bboxes = list(map(tuple, columns.T.tolist()))
+        else:
+            bboxes = [_bbox_tuple(vs) for vs in vertex_lists]
+            columns = np.array(bboxes, dtype=np.float64).reshape(-1, 6).T.copy()
+        self.bboxes = bboxes
+        self.min_x, self.min_y, self.max_x, self.max_y, self.cx, self.cy = columns
+        # Stable sorts, so equal coordinates stay in line order
+        self.order_by_min_y = sorted(range(len(bboxes)), key=lambda i: bboxes[i][1])
+        self.min_y_sorted = [bboxes[i][1] for i in self.order_by_min_y]
+        self.order_by_cy = sorted(range(len(bboxes)), key=lambda i: bboxes[i][5])
+        self.cy_sorted = [bboxes[i][5] for i in self.order_by_cy]
+        self.anchors: Dict[str, Optional[int]] = {kw: _pick_anchor(self, kw, hits[kw]) for kw in anchor_keywords}
+        self.values: Dict[str, Optional[str]] = {}
+
+
+def build_page_ctxs(document, anchor_keywords=()) -> List[PageCtx]:
+    """Builds a PageCtx for every page of the document (or just the first, see _USE_FIRST_PAGE_ONLY)."""
+    document_text = document.text
+    pages = document.pages[:1] if _USE_FIRST_PAGE_ONLY else document.pages
+    return [PageCtx(page, document_text, anchor_keywords) for page in pages]
+
+
+# Every header keyword extract_bol_data anchors on, resolved while building each PageCtx.
+BOL_ANCHOR_KEYWORDS = (
+    "shipper", "consignee", "notify", "vessel", "initial carriage", "voyage-no", "voy",
+)
+
+
+# The only Document fields extract_bol_data reads. Document AI field masks accept
+# top-level fields and direct `pages.` children only.
+BOL_FIELD_MASK = "text,pages.page_number,pages.lines"
+
+
 def extract_bol_data(document):
     """
     Extracts key fields from a Document AI processed invoice.
-    Uses a hybrid approach:
-    1. Gets all key-value pairs from the Form Parser.
-    2. Uses custom logic for fields the parser misses or gets wrong.
+    Uses geometric header/value logic over the Form Parser's OCR lines,
+    with text-regex fallbacks for fields the geometry misses.
 
     We are creating the entire dictionary key here, but some fields that aren't captured here are captured by the Agent:
     - container numbers
@@ -31,14 +151,9 @@ def extract_bol_data(document):
     - total cartons
     Hence the above will always be null from this output.
     """
-    document_text = document.text
-    
-    form_data = {}
-    for page in document.pages:
-        for field in page.form_fields:
-            key = get_text(field.field_name.text_anchor, document_text).strip().lower()
-            value = get_text(field.field_value.text_anchor, document_text).strip()
-            form_data[key] = value
+    # Single traversal of the pages: line texts, geometry and every BOL anchor
+    # keyword, shared by the geometric helpers below.
+    page_ctxs = build_page_ctxs(document, BOL_ANCHOR_KEYWORDS)
 
     extracted_data = {
         "exporter_address": None,
@@ -57,7 +172,8 @@ def extract_bol_data(document):
     document,
     start_keyword="Shipper",
     stop_keywords=["Consignee"],
-    horizontal_constraint="left"
+    horizontal_constraint="left",
+    page_ctxs=page_ctxs
 )
     # NEW: fallback if geometry failed
     if not raw_exporter:
@@ -75,7 +191,8 @@ def extract_bol_data(document):
         start_keyword="Consignee",
         stop_keywords=["Notify"],
         horizontal_constraint="left",
-        exclude_keywords=consignee_exclusions
+        exclude_keywords=consignee_exclusions,
+        page_ctxs=page_ctxs
     )
 
     # Fallback: text-only regex if geometric extraction failed
@@ -95,7 +212,8 @@ def extract_bol_data(document):
         start_keyword="Notify",
         stop_keywords=["Vessel", "Initial Carriage"],
         horizontal_constraint="left",
-        exclude_keywords=notify_exclusions
+        exclude_keywords=notify_exclusions,
+        page_ctxs=page_ctxs
     )
 
     # Fallback: text-only regex if geometric extraction failed
@@ -104,40 +222,74 @@ def extract_bol_data(document):
         if alt_notify:
             extracted_data["notify_party_details"] = alt_notify
 
-    transport_details = extract_bol_vessel_voyage(document)
+    transport_details = extract_bol_vessel_voyage(document, page_ctxs)
     extracted_data["vessel_name"] = transport_details.get("vessel_name")
     extracted_data["voyage"] = transport_details.get("voyage")
-    extracted_data["port_of_destination"] = extract_bol_port_of_destination(document)
+    extracted_data["port_of_destination"] = extract_bol_port_of_destination(document, page_ctxs)
 
     return extracted_data
 
-def find_line_by_substring(page, substring: str, document_text: str):
+def find_line_by_substring(ctx: PageCtx, substring_lower: str) -> Optional[int]:
+    """
+    Finds the most likely header line containing a specific substring
+    (see _pick_anchor for the preference order).
+
+    The substring must already be lowercased by the caller. Returns the
+    index of the chosen line within ctx.lines.
+    """
+    if substring_lower not in ctx.anchors:
+        index_anchors(ctx, (substring_lower,))
+    return ctx.anchors[substring_lower]
+
+
+def index_anchors(ctx: PageCtx, keywords_lower) -> None:
+    """
+    Resolves the anchor line for several lowercased keywords in a single
+    pass over the page's lines and memoises the results in ctx.anchors.
+    """
+    pending = list(dict.fromkeys(kw for kw in keywords_lower if kw not in ctx.anchors))
+    if not pending:
+        return
+
+    hits: Dict[str, List[int]] = {kw: [] for kw in pending}
+    active = list(pending)
+    for i, lt in enumerate(ctx.texts_lower):
+        if not lt:
+            continue
+        for kw in active:
+            if kw in lt:
+                hits[kw].append(i)
+        # An exact header line always wins, so stop looking for that keyword
+        if lt in active:
+            active.remove(lt)
+            if not active:
+                break
+
+    for kw in pending:
+        ctx.anchors[kw] = _pick_anchor(ctx, kw, hits[kw])
+
+
+def _pick_anchor(ctx: PageCtx, target: str, indices: List[int]) -> Optional[int]:
     """
-    Finds the most likely header line containing a specific substring:
+    Picks the most likely header line among the lines containing target:
     - Prefer exact match (line == substring, ignoring case)
     - Then prefer lines that start with the keyword (e.g. 'Shipper ...')
       and are not possessive like 'SHIPPER'S ...'
     - Finally, fall back to the shortest matching line.
     """
-    target = substring.lower()
     candidates = []
 
-    for line in page.lines:
-        line_text = get_text(line.layout.text_anchor, document_text).strip()
-        if not line_text:
-            continue
-
-        lt = line_text.lower()
-        if target in lt:
-            candidates.append({
-                "line": line,
-                "text": line_text,
-                "lt": lt,
-                "exact": lt == target,
-                "starts_with": lt.startswith(target),
-                # Handle cases like "SHIPPER'S LOAD..." (we usually want to avoid these as anchors)
-                "has_possessive": (target + "'s") in lt,
-            })
+    for i in indices:
+        lt = ctx.texts_lower[i]
+        candidates.append({
+            "index": i,
+            "text": ctx.texts[i],
+            "lt": lt,
+            "exact": lt == target,
+            "starts_with": lt.startswith(target),
+            # Handle cases like "SHIPPER'S LOAD..." (we usually want to avoid these as anchors)
+            "has_possessive": (target + "'s") in lt,
+        })
 
     if not candidates:
         return None
@@ -147,7 +299,7 @@ def find_line_by_substring(page, substring: str, document_text: str):
     if exacts:
         # If more than one, choose the shortest line
         best = min(exacts, key=lambda c: len(c["text"]))
-        return best["line"]
+        return best["index"]
 
     # 2) Prefer lines that start with the keyword and are NOT possessive
     #    ('Shipper ...' yes, 'SHIPPER'S LOAD...' no)
@@ -157,24 +309,25 @@ def find_line_by_substring(page, substring: str, document_text: str):
     ]
     if starts_clean:
         best = min(starts_clean, key=lambda c: len(c["text"]))
-        return best["line"]
+        return best["index"]
 
     # 3) Then allow starts_with even if possessive, if nothing else found
     starts_any = [c for c in candidates if c["starts_with"]]
     if starts_any:
         best = min(starts_any, key=lambda c: len(c["text"]))
-        return best["line"]
+        return best["index"]
 
     # 4) Fallback: shortest line containing the keyword
     best = min(candidates, key=lambda c: len(c["text"]))
-    return best["line"]
+    return best["index"]
 
 def extract_block_between_headers(
     document: dict, 
     start_keyword: str,
     stop_keywords: List[str],
     horizontal_constraint: str = "left",
-    exclude_keywords: Optional[List[str]] = None
+    exclude_keywords: Optional[List[str]] = None,
+    page_ctxs: Optional[List[PageCtx]] = None
 ) -> Optional[str]:
     """
     The definitive universal function. Extracts a block of text between a
@@ -182,88 +335,84 @@ def extract_block_between_headers(
     """
     if not document.pages:
         return None
-        
-    document_text = document.text
+    if page_ctxs is None:
+        page_ctxs = build_page_ctxs(document)
+
+    start_keyword_lower = start_keyword.lower()
+    stop_keywords_lower = [stop_word.lower() for stop_word in stop_keywords]
+    exclude_keywords_lower = [keyword.lower() for keyword in exclude_keywords or []]
+
+    for ctx in page_ctxs:
+        page = ctx.page
+        bboxes = ctx.bboxes
 
-    for page in document.pages:
         # Step 1: Find the start anchor
-        start_anchor = find_line_by_substring(page, start_keyword, document_text)
-        if not start_anchor:
+        start_idx = find_line_by_substring(ctx, start_keyword_lower)
+        if start_idx is None:
             continue
 
         # --- Find all potential stop anchors and choose the closest one ---
-        potential_stops = []
-        for stop_word in stop_keywords:
-            stop_anchor_candidate = find_line_by_substring(page, stop_word, document_text)
-            if stop_anchor_candidate:
-                # Store the anchor and its top y-coordinate
-                stop_top_y = min(v.y for v in stop_anchor_candidate.layout.bounding_poly.normalized_vertices)
-                potential_stops.append((stop_top_y, stop_anchor_candidate))
+        # The definitive stop anchor is the closest one below the start anchor (ties go to the earlier line)
+        start_anchor_bottom_y = bboxes[start_idx][3]
+        found_stop = False
+        best_stop = None
+        for stop_word_lower in stop_keywords_lower:
+            stop_idx_candidate = find_line_by_substring(ctx, stop_word_lower)
+            if stop_idx_candidate is None:
+                continue
+            found_stop = True
+            candidate = (bboxes[stop_idx_candidate][1], stop_idx_candidate)
+            if candidate[0] > start_anchor_bottom_y and (best_stop is None or candidate < best_stop):
+                best_stop = candidate
         
-        if not potential_stops:
-            print(f"Found start anchor '{start_keyword}' but none of the stop keywords.")
+        if not found_stop:
+            logger.debug("Found start anchor '%s' but none of the stop keywords.", start_keyword)
             continue
-            
-        # Sort potential stops by their vertical position
-        potential_stops.sort()
-        
-        # The definitive stop anchor is the first one found below the start anchor
-        start_anchor_bottom_y = max(v.y for v in start_anchor.layout.bounding_poly.normalized_vertices)
-        definitive_stop_anchor = None
-        for stop_y, stop_anchor in potential_stops:
-            if stop_y > start_anchor_bottom_y:
-                definitive_stop_anchor = stop_anchor
-                break 
                 
-        if not definitive_stop_anchor:
-            print(f"Found stop keywords, but none were below the start anchor '{start_keyword}'.")
+        stop_idx = best_stop[1] if best_stop else None
+        if stop_idx is None:
+            logger.debug("Found stop keywords, but none were below the start anchor '%s'.", start_keyword)
             continue
 
-        stop_keyword_text = get_text(definitive_stop_anchor.layout.text_anchor, document_text)
-        print(f"Found anchors '{start_keyword}' and closest stop '{stop_keyword_text}' on Page {page.page_number}.")
+        logger.debug(
+            "Found anchors '%s' and closest stop '%s' on Page %s.",
+            start_keyword, ctx.raw_texts[stop_idx], page.page_number,
+        )
         
         # --- The rest of the function proceeds as before with the definitive anchors ---
-        start_bbox = start_anchor.layout.bounding_poly
-        stop_below_bbox = definitive_stop_anchor.layout.bounding_poly
-        
-        search_top_y = max(v.y for v in start_bbox.normalized_vertices)
-        search_bottom_y = min(v.y for v in stop_below_bbox.normalized_vertices)
-        slice_boundary_x = min(v.x for v in start_bbox.normalized_vertices)
+        search_top_y = bboxes[start_idx][3]
+        search_bottom_y = bboxes[stop_idx][1]
+        slice_boundary_x = bboxes[start_idx][0]
         
         if search_bottom_y <= search_top_y:
             continue
 
-        print(f"Defined vertical search: y=({search_top_y:.3f}, {search_bottom_y:.3f}). Left slice at x > {slice_boundary_x:.3f}")
+        logger.debug(
+            "Defined vertical search: y=(%.3f, %.3f). Left slice at x > %.3f",
+            search_top_y, search_bottom_y, slice_boundary_x,
+        )
+
+        # Only lines whose centre lies strictly inside the band can qualify: bisect
+        # the centre-sorted index for them, then apply the column filters to that slice.
+        lo = bisect.bisect_right(ctx.cy_sorted, search_top_y)
+        hi = bisect.bisect_left(ctx.cy_sorted, search_bottom_y)
+        band = np.array(ctx.order_by_cy[lo:hi], dtype=np.intp)
+        mask = (ctx.min_x[band] >= slice_boundary_x - 0.01) & (band != start_idx) & (band != stop_idx)
+        if horizontal_constraint == "left":
+            mask &= ctx.cx[band] < 0.5
+        elif horizontal_constraint == "right":
+            mask &= ctx.cx[band] >= 0.5
 
         found_lines_with_pos = []
-        for line in page.lines:
-            if line in [start_anchor, definitive_stop_anchor]: continue
-
-            line_bbox = line.layout.bounding_poly
-            line_center_y = (min(v.y for v in line_bbox.normalized_vertices) + max(v.y for v in line_bbox.normalized_vertices)) / 2.0
-            
-            if not (search_top_y < line_center_y < search_bottom_y):
-                continue
-            
-            line_left_x = min(v.x for v in line_bbox.normalized_vertices)
-            if line_left_x < (slice_boundary_x - 0.01):
-                continue
+        for i in band[mask].tolist():
+            line_text = ctx.texts[i]
             
-            line_center_x = (min(v.x for v in line_bbox.normalized_vertices) + max(v.x for v in line_bbox.normalized_vertices)) / 2.0
-            if horizontal_constraint == "left" and line_center_x >= 0.5:
-                continue
-            elif horizontal_constraint == "right" and line_center_x < 0.5:
+            line_text_lower = ctx.texts_lower[i]
+            if any(keyword in line_text_lower for keyword in exclude_keywords_lower):
                 continue
             
-            line_text = get_text(line.layout.text_anchor, document_text).strip()
-            
-            if exclude_keywords:
-                if any(re.search(re.escape(keyword), line_text, re.IGNORECASE) for keyword in exclude_keywords):
-                    continue
-            
             if line_text:
-                line_top_y = min(v.y for v in line_bbox.normalized_vertices)
-                found_lines_with_pos.append((line_top_y, line_text))
+                found_lines_with_pos.append((bboxes[i][1], line_text))
 
         if not found_lines_with_pos:
             continue
@@ -271,84 +420,79 @@ def extract_block_between_headers(
         found_lines_with_pos.sort()
         final_block = "\n".join([text for _, text in found_lines_with_pos])
         
-        print(f"SUCCESS: Extracted block for '{start_keyword}'.")
+        logger.debug("SUCCESS: Extracted block for '%s'.", start_keyword)
         return final_block
 
-    print(f"Could not find a valid text block for '{start_keyword}' on any page.")
+    logger.debug("Could not find a valid text block for '%s' on any page.", start_keyword)
     return None
 
 
-def extract_line_under_header(document: dict, header_keyword: str) -> Optional[str]:
+def extract_line_under_header(
+    document: dict,
+    header_keyword: str,
+    page_ctxs: Optional[List[PageCtx]] = None
+) -> Optional[str]:
     """
     A robust function that finds a header by keyword and returns the text
     of the first valid data line below it, skipping over other potential headers.
     """
     if not document.pages:
         return None
-        
-    document_text = document.text
+    if page_ctxs is None:
+        page_ctxs = build_page_ctxs(document)
+
+    header_keyword_lower = header_keyword.lower()
 
-    for page in document.pages:
-        anchor_line = find_line_by_substring(page, header_keyword, document_text)
+    for ctx in page_ctxs:
+        anchor_idx = find_line_by_substring(ctx, header_keyword_lower)
         
-        if not anchor_line:
+        if anchor_idx is None:
             continue
             
-        anchor_bbox = anchor_line.layout.bounding_poly
-        anchor_center_x = (min(v.x for v in anchor_bbox.normalized_vertices) + max(v.x for v in anchor_bbox.normalized_vertices)) / 2.0
-        anchor_bottom_y = max(v.y for v in anchor_bbox.normalized_vertices)
+        _, _, _, anchor_bottom_y, anchor_center_x, _ = ctx.bboxes[anchor_idx]
         
         column_tolerance = 0.20 # Use a slightly wider tolerance to be safe
         search_left_x = anchor_center_x - column_tolerance
         search_right_x = anchor_center_x + column_tolerance
 
-        # Find all candidate lines below the anchor
-        candidate_lines_with_pos = []
-        for line in page.lines:
-            if line == anchor_line: continue
-                
-            line_bbox = line.layout.bounding_poly
-            line_top_y = min(v.y for v in line_bbox.normalized_vertices)
-            line_center_x = (min(v.x for v in line_bbox.normalized_vertices) + max(v.x for v in line_bbox.normalized_vertices)) / 2.0
-
-            if line_top_y > anchor_bottom_y and search_left_x < line_center_x < search_right_x:
-                candidate_lines_with_pos.append((line_top_y, line))
-        
-        if not candidate_lines_with_pos:
-            continue
-
-        # Sort the candidates by how close they are vertically
-        candidate_lines_with_pos.sort()
-
         # --- Filter out lines that look like other headers ---
         # A blacklist of keywords that are likely to be headers, not data.
         HEADER_BLACKLIST = ["PORT OF", "FINAL DESTINATION", "PLACE OF", "RECEIPT", "LOADING"]
 
-        for _, line_object in candidate_lines_with_pos:
-            line_text = get_text(line_object.layout.text_anchor, document_text).strip()
+        # Walk the lines below the anchor, closest first (the y index is already sorted)
+        found_candidate = False
+        start = bisect.bisect_right(ctx.min_y_sorted, anchor_bottom_y)
+        for i in ctx.order_by_min_y[start:]:
+            if i == anchor_idx: continue
+            if not (search_left_x < ctx.bboxes[i][4] < search_right_x): continue
+            found_candidate = True
+
+            line_text = ctx.texts[i]
             
             # Check if the line text contains any blacklisted header phrases
             if not any(keyword in line_text.upper() for keyword in HEADER_BLACKLIST):
                 return line_text
-        return None
+
+        if found_candidate:
+            return None
     return None
 
 
-def get_line_center(line) -> Tuple[float, float]:
-    """Gets the (x, y) center of a line's bounding box."""
-    bbox = line.layout.bounding_poly
-    center_x = (min(v.x for v in bbox.normalized_vertices) + max(v.x for v in bbox.normalized_vertices)) / 2.0
-    center_y = (min(v.y for v in bbox.normalized_vertices) + max(v.y for v in bbox.normalized_vertices)) / 2.0
-    return (center_x, center_y)
+# First whitespace/hyphen-delimited token that is 3-10 alphanumerics and contains a digit.
+_VOYAGE_RE = re.compile(r'(?<![^\s-])(?=[^\s-]*\d)[^\W_]{3,10}(?![^\s-])')
+
 
 def find_voyage_code_final(text: str) -> Optional[str]:
     """The definitive voyage code finder."""
     if not text: return None
-    words = re.split(r'[\s-]+', text)
-    for word in words:
-        if 3 <= len(word) <= 10 and word.isalnum() and any(char.isdigit() for char in word):
-            return word.upper()
-    return None
+    m = _VOYAGE_RE.search(text)
+    return m.group(0).upper() if m else None
+
+
+# Words that indicate a value is probably another header, not a value.
+HEADER_KEYWORDS = ("voyage", "voy", "no", "clause", "vessel")
+# Any keyword as a substring of the lowercased text, in one scan
+_HEADER_LIKE_RE = re.compile("|".join(map(re.escape, HEADER_KEYWORDS)))
 
 
 def is_header_like(text: str) -> bool:
@@ -356,28 +500,79 @@ def is_header_like(text: str) -> bool:
     A helper to check if a string looks like part of a header,
     rather than a real value.
     """
-    text_lower = text.lower()
-    # A list of words that indicate this is probably another header, not a value.
-    header_keywords = ["voyage", "voy", "no", "clause", "vessel"]
     # If the text contains any of these keywords, it's likely a header.
-    return any(keyword in text_lower for keyword in header_keywords)
+    return _HEADER_LIKE_RE.search(text.lower()) is not None
+
+
+def _neighbors(ctx: PageCtx, anchor_idx: int) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Finds both the closest line to the RIGHT of the anchor and the closest line
+    BELOW it, bisecting the page's sorted y indices instead of scanning every
+    line. Returns their indices (or None); ties go to the earlier line.
+    """
+    bboxes = ctx.bboxes
+    _, _, anchor_right_x, _, anchor_center_x, anchor_center_y = bboxes[anchor_idx]
+    horizontal_gap_threshold = 0.05
 
+    # RIGHT: same row, starts after the anchor ends, within the gap threshold.
+    # The bisect window is padded slightly; the exact row test is applied below.
+    right_idx = None
+    min_dist_right = float('inf')
+    lo = bisect.bisect_left(ctx.cy_sorted, anchor_center_y - 0.02 - 1e-9)
+    hi = bisect.bisect_right(ctx.cy_sorted, anchor_center_y + 0.02 + 1e-9)
+    for i in sorted(ctx.order_by_cy[lo:hi]):
+        if i == anchor_idx: continue
+        line_left_x, _, _, _, _, line_center_y = bboxes[i]
+        if abs(line_center_y - anchor_center_y) < 0.02 and line_left_x > anchor_right_x:
+            distance = line_left_x - anchor_right_x
+            if distance < min_dist_right and distance < horizontal_gap_threshold:
+                min_dist_right = distance
+                right_idx = i
+
+    # BELOW: must be below and in a reasonably similar column. Lines are visited
+    # closest first, so stop as soon as they are further than the best match.
+    below_idx = None
+    min_dist_below = float('inf')
+    min_y_sorted = ctx.min_y_sorted
+    order = ctx.order_by_min_y
+    for pos in range(bisect.bisect_right(min_y_sorted, anchor_center_y), len(order)):
+        distance = min_y_sorted[pos] - anchor_center_y
+        if distance > min_dist_below:
+            break
+        i = order[pos]
+        if i == anchor_idx: continue
+        if abs(bboxes[i][4] - anchor_center_x) < 0.2:
+            if distance < min_dist_below or i < below_idx:
+                min_dist_below = distance
+                below_idx = i
 
-def find_value_for_header_final(page, document_text: str, keyword: str) -> Optional[str]:
+    return right_idx, below_idx
+
+
+def find_value_for_header_final(ctx: PageCtx, keyword: str) -> Optional[str]:
     """
     The definitive helper. Intelligently checks for a value on the same line,
     ignoring it if it looks like another header, then checks to the right, and finally below.
+    Results are memoised per page, so repeated lookups of the same header are free.
     """
-    anchor_line = find_line_by_substring(page, keyword, document_text)
-    if not anchor_line:
+    keyword_lower = keyword.lower()
+    if keyword_lower not in ctx.values:
+        ctx.values[keyword_lower] = _find_value_for_header(ctx, keyword_lower)
+    return ctx.values[keyword_lower]
+
+
+def _find_value_for_header(ctx: PageCtx, keyword_lower: str) -> Optional[str]:
+    """Uncached body of find_value_for_header_final."""
+    anchor_idx = find_line_by_substring(ctx, keyword_lower)
+    if anchor_idx is None:
         return None
 
-    anchor_text = get_text(anchor_line.layout.text_anchor, document_text)
+    anchor_text = ctx.texts[anchor_idx]
     words = anchor_text.split()
     
     keyword_index = -1
     for i, word in enumerate(words):
-        if keyword.lower() in word.lower():
+        if keyword_lower in word.lower():
             keyword_index = i
             break
             
@@ -387,43 +582,22 @@ def find_value_for_header_final(page, document_text: str, keyword: str) -> Optio
         if value_on_same_line and not is_header_like(value_on_same_line):
             return value_on_same_line
 
-    anchor_bbox = anchor_line.layout.bounding_poly
-    anchor_center_y = get_line_center(anchor_line)[1]
-    anchor_right_x = max(v.x for v in anchor_bbox.normalized_vertices)
-    anchor_center_x = get_line_center(anchor_line)[0]
-    
+    right_idx, below_idx = _neighbors(ctx, anchor_idx)
+
     # Look for value to the RIGHT (with gap check)
-    horizontal_gap_threshold = 0.05
-    closest_right_value = None
-    min_dist_right = float('inf')
-    for line in page.lines:
-        if line == anchor_line: continue
-        if abs(get_line_center(line)[1] - anchor_center_y) < 0.02:
-            line_left_x = min(v.x for v in line.layout.bounding_poly.normalized_vertices)
-            if line_left_x > anchor_right_x:
-                distance = line_left_x - anchor_right_x
-                if distance < min_dist_right and distance < horizontal_gap_threshold:
-                    min_dist_right = distance
-                    closest_right_value = get_text(line.layout.text_anchor, document_text)
+    closest_right_value = ctx.raw_texts[right_idx] if right_idx is not None else None
     if closest_right_value:
         return closest_right_value.strip()
 
     # If nothing else, look BELOW
-    closest_below_value = None
-    min_dist_below = float('inf')
-    for line in page.lines:
-        if line == anchor_line: continue
-        line_top_y = min(v.y for v in line.layout.bounding_poly.normalized_vertices)
-        # Must be below and in a reasonably similar column
-        if line_top_y > anchor_center_y and abs(get_line_center(line)[0] - anchor_center_x) < 0.2:
-            distance = line_top_y - anchor_center_y
-            if distance < min_dist_below:
-                min_dist_below = distance
-                closest_below_value = get_text(line.layout.text_anchor, document_text)
+    closest_below_value = ctx.raw_texts[below_idx] if below_idx is not None else None
     return closest_below_value.strip() if closest_below_value else None
 
 
-def extract_bol_vessel_voyage(document: dict) -> Dict[str, Optional[str]]:
+def extract_bol_vessel_voyage(
+    document: dict,
+    page_ctxs: Optional[List[PageCtx]] = None
+) -> Dict[str, Optional[str]]:
     """
     Master function:
     1) Try geometry-based header/value logic (current behaviour).
@@ -434,44 +608,43 @@ def extract_bol_vessel_voyage(document: dict) -> Dict[str, Optional[str]]:
     if not document.pages:
         return results
         
-    page = document.pages[0]
-    document_text = document.text
+    ctx = page_ctxs[0] if page_ctxs else PageCtx(document.pages[0], document.text)
 
-    print("\n--- Running 'Vessel First' Strategy with Universal Helper ---")
+    logger.debug("--- Running 'Vessel First' Strategy with Universal Helper ---")
     
-    vessel_candidate_text = find_value_for_header_final(page, document_text, "Vessel")
+    vessel_candidate_text = find_value_for_header_final(ctx, "Vessel")
     
     if vessel_candidate_text:
-        print(f"  - Found vessel candidate text: '{vessel_candidate_text}'")
+        logger.debug("  - Found vessel candidate text: '%s'", vessel_candidate_text)
         voyage_code_in_vessel = find_voyage_code_final(vessel_candidate_text)
         
         if voyage_code_in_vessel:
             results["voyage"] = voyage_code_in_vessel
             results["vessel_name"] = vessel_candidate_text.replace(voyage_code_in_vessel, "").strip(' -')
-            print(f"SUCCESS (Merged Field): Vessel='{results['vessel_name']}', Voyage='{results['voyage']}'")
+            logger.debug("SUCCESS (Merged Field): Vessel='%s', Voyage='%s'", results["vessel_name"], results["voyage"])
         else:
             results["vessel_name"] = vessel_candidate_text
-            print(f"  - No voyage code in vessel string. Now searching for separate voyage value...")
+            logger.debug("  - No voyage code in vessel string. Now searching for separate voyage value...")
             
-            voyage_candidate_text = find_value_for_header_final(page, document_text, "Voyage-No")
+            voyage_candidate_text = find_value_for_header_final(ctx, "Voyage-No")
             if not voyage_candidate_text:
-                voyage_candidate_text = find_value_for_header_final(page, document_text, "Voy")
+                voyage_candidate_text = find_value_for_header_final(ctx, "Voy")
             
             voyage_code = find_voyage_code_final(voyage_candidate_text)
             
             if voyage_code:
                 results["voyage"] = voyage_code
-                print(f"SUCCESS (Separate Fields): Vessel='{results['vessel_name']}', Voyage='{results['voyage']}'")
+                logger.debug("SUCCESS (Separate Fields): Vessel='%s', Voyage='%s'", results["vessel_name"], results["voyage"])
             else:
-                print(f"  - Found text '{voyage_candidate_text}' but it contains no valid voyage code. Discarding.")
+                logger.debug("  - Found text '%s' but it contains no valid voyage code. Discarding.", voyage_candidate_text)
                 results["voyage"] = None
-                print(f"SUCCESS (Vessel Only): Vessel='{results['vessel_name']}', Voyage='{results['voyage']}'")
+                logger.debug("SUCCESS (Vessel Only): Vessel='%s', Voyage='%s'", results["vessel_name"], results["voyage"])
     else:
-        print("Could not find any value for the 'Vessel' keyword using geometry-based search.")
+        logger.debug("Could not find any value for the 'Vessel' keyword using geometry-based search.")
 
     # --- Existing sanity check: if vessel looks weird, rely fully on regex ---
     if not is_plausible_vessel_name(results["vessel_name"]):
-        print("Vessel candidate looks implausible. Falling back to text-based regex extractor...")
+        logger.debug("Vessel candidate looks implausible. Falling back to text-based regex extractor...")
         regex_result = extract_bol_vessel_voyage_regex(document)
         if regex_result.get("vessel_name"):
             results["vessel_name"] = regex_result["vessel_name"]
@@ -480,16 +653,16 @@ def extract_bol_vessel_voyage(document: dict) -> Dict[str, Optional[str]]:
 
     # --- NEW: If voyage is still missing, use regex JUST to backfill voyage ---
     if results["voyage"] is None:
-        print("Voyage code still missing after geometry. Trying regex-based voyage extraction...")
+        logger.debug("Voyage code still missing after geometry. Trying regex-based voyage extraction...")
         regex_result = extract_bol_vessel_voyage_regex(document)
         # Only overwrite vessel if we never got one from geometry
         if not results["vessel_name"] and regex_result.get("vessel_name"):
             results["vessel_name"] = regex_result["vessel_name"]
         if regex_result.get("voyage") and regex_result["voyage"] != results["vessel_name"]:
             results["voyage"] = regex_result["voyage"]
-            print(f"SUCCESS (Regex Voyage Backfill): Vessel='{results['vessel_name']}', Voyage='{results['voyage']}'")
+            logger.debug("SUCCESS (Regex Voyage Backfill): Vessel='%s', Voyage='%s'", results["vessel_name"], results["voyage"])
         else:
-            print("Regex voyage backfill did not find a valid voyage code.")
+            logger.debug("Regex voyage backfill did not find a valid voyage code.")
 
     return results
 
@@ -498,8 +671,7 @@ def extract_bol_vessel_voyage(document: dict) -> Dict[str, Optional[str]]:
 
 
 def find_value_for_header_with_blacklist(
-    page, 
-    document_text: str, 
+    ctx: PageCtx,
     keyword: str, 
     ignore_list: List[str] = None
 ) -> Optional[str]:
@@ -509,111 +681,119 @@ def find_value_for_header_with_blacklist(
     """
     if ignore_list is None:
         ignore_list = []
+    keyword_lower = keyword.lower()
+    ignore_list_lower = [ignored_word.lower() for ignored_word in ignore_list]
 
     # Step 1: Find a valid anchor line
-    anchor_line = None
-    for line in page.lines:
-        line_text = get_text(line.layout.text_anchor, document_text)
-        line_text_lower = line_text.lower()
-        
+    anchor_idx = None
+    for i, line_text_lower in enumerate(ctx.texts_lower):
         # Condition 1: The line must contain our main keyword
-        if keyword.lower() in line_text_lower:
+        if keyword_lower in line_text_lower:
             # Condition 2: The line must NOT contain any of the ignored words
-            is_ignored = any(ignored_word.lower() in line_text_lower for ignored_word in ignore_list)
+            is_ignored = any(ignored_word in line_text_lower for ignored_word in ignore_list_lower)
             
             if not is_ignored:
-                anchor_line = line
+                anchor_idx = i
                 break 
     
-    if not anchor_line:
+    if anchor_idx is None:
         return None
 
     # Step 2: Now that we have a VALID anchor, find its value
     # Check same line
-    anchor_text = get_text(anchor_line.layout.text_anchor, document_text)
+    anchor_text = ctx.texts[anchor_idx]
     words = anchor_text.split()
     keyword_index = -1
     for i, word in enumerate(words):
-        if keyword.lower() in word.lower():
+        if keyword_lower in word.lower():
             keyword_index = i
             break
     if keyword_index != -1 and keyword_index < len(words) - 1:
         value = " ".join(words[keyword_index + 1:]).strip(":- ")
         if value: return value
 
+    right_idx, below_idx = _neighbors(ctx, anchor_idx)
+
     # Check right
-    anchor_bbox = anchor_line.layout.bounding_poly
-    anchor_center_y = get_line_center(anchor_line)[1]
-    anchor_right_x = max(v.x for v in anchor_bbox.normalized_vertices)
-    closest_right_value = None
-    min_dist = float('inf')
-    for line in page.lines:
-        if line == anchor_line: continue
-        if abs(get_line_center(line)[1] - anchor_center_y) < 0.02 and min(v.x for v in line.layout.bounding_poly.normalized_vertices) > anchor_right_x:
-            dist = min(v.x for v in line.layout.bounding_poly.normalized_vertices) - anchor_right_x
-            if dist < min_dist and dist < 0.05:
-                min_dist = dist
-                closest_right_value = get_text(line.layout.text_anchor, document_text)
+    closest_right_value = ctx.raw_texts[right_idx] if right_idx is not None else None
     if closest_right_value: return closest_right_value.strip()
 
     # Check below
-    anchor_center_x = get_line_center(anchor_line)[0]
-    closest_below_value = None
-    min_dist = float('inf')
-    for line in page.lines:
-        if line == anchor_line: continue
-        line_top_y = min(v.y for v in line.layout.bounding_poly.normalized_vertices)
-        if line_top_y > anchor_center_y and abs(get_line_center(line)[0] - anchor_center_x) < 0.2:
-            dist = line_top_y - anchor_center_y
-            if dist < min_dist:
-                min_dist = dist
-                closest_below_value = get_text(line.layout.text_anchor, document_text)
+    closest_below_value = ctx.raw_texts[below_idx] if below_idx is not None else None
     return closest_below_value.strip() if closest_below_value else None
 
 
 
-def extract_bol_port_of_destination(document: dict) -> Optional[str]:
+def extract_bol_port_of_destination(
+    document: dict,
+    page_ctxs: Optional[List[PageCtx]] = None
+) -> Optional[str]:
     """
     Extracts the Port of Destination using the helper with a blacklist.
     """
     if not document.pages:
         return None
         
-    page = document.pages[0]
-    document_text = document.text
+    ctx = page_ctxs[0] if page_ctxs else PageCtx(document.pages[0], document.text)
     
-    print("\n--- Extracting Port of Destination with Blacklist Logic ---")
+    logger.debug("--- Extracting Port of Destination with Blacklist Logic ---")
 
     # Attempt 1: Look for "PORT OF DISCHARGE"  
-    print("  - Searching for 'PORT OF DISCHARGE', ignoring 'AGENT'...")
+    logger.debug("  - Searching for 'PORT OF DISCHARGE', ignoring 'AGENT'...")
     
     value = find_value_for_header_with_blacklist(
-        page, 
-        document_text, 
+        ctx,
         keyword="PORT OF DISCHARGE", 
         ignore_list=["AGENT"]  
     )
     
     if value and not is_header_like(value):
-        print(f"SUCCESS: Found value '{value}' for keyword 'PORT OF DISCHARGE'.")
+        logger.debug("SUCCESS: Found value '%s' for keyword 'PORT OF DISCHARGE'.", value)
         return value
 
     # Attempt 2 (Fallback): Look for "PORT OF DESTINATION"
-    print("  - 'PORT OF DISCHARGE' not found or invalid. Trying 'PORT OF DESTINATION'...")
+    logger.debug("  - 'PORT OF DISCHARGE' not found or invalid. Trying 'PORT OF DESTINATION'...")
     
     value = find_value_for_header_with_blacklist(
-        page, 
-        document_text, 
+        ctx,
         keyword="PORT OF DESTINATION"
     )
     
     if value and not is_header_like(value):
-        print(f"SUCCESS: Found value '{value}' for keyword 'PORT OF DESTINATION'.")
+        logger.debug("SUCCESS: Found value '%s' for keyword 'PORT OF DESTINATION'.", value)
         return value
     
-    print("--- FAILED to find Port of Destination. ---")
+    logger.debug("--- FAILED to find Port of Destination. ---")
     return None
 
+# Text-only fallback patterns, compiled once at import
+_CONSIGNEE_RE = re.compile(
+    r'Consignee[^\n]*\n(.*?)(?=\nNotify Party)',  # stop right before the next 'Notify Party' line
+    re.IGNORECASE | re.DOTALL,
+)
+# Lines we *never* want in consignee details
+_CONSIGNEE_EXCLUDE_RE = re.compile(
+    r"As principal, where"   # the exact junk line you showed
+    r"|care of",             # catches "care of", "c/o", etc if they appear elsewhere
+    re.IGNORECASE,
+)
+_NOTIFY_RE = re.compile(
+    r'Notify Party\s*\(see clause 22\)[^\n]*\n(.*?)(?=\nVessel\b|\nVessel\s*\(see|\Z)',
+    re.IGNORECASE | re.DOTALL,
+)
+_VESSEL_BLOCK_RE = re.compile(r"Vessel[^\n]*\n([^\n]+)\n\s*Voyage", re.IGNORECASE)
+_VOYAGE_NO_RE = re.compile(r"Voyage\s*No\.?\s*\n([^\n]+)", re.IGNORECASE)
+_VOYAGE_WORD_RE = re.compile(r"\bVoyage\b", re.IGNORECASE)
+# Everything after the Shipper header up to the Consignee header
+_SHIPPER_RE = re.compile(
+    r"Shipper\s*\(.*?\)[^\n]*\n(.*?)(?=\nConsignee\s*\(|\nNotify Party|\nThis contract is subject)",
+    re.IGNORECASE | re.DOTALL,
+)
+# Contact lines in an exporter address block: anything with an '@', lines
+# starting with tel/phone/fax, or phone-number-only lines like "+27 ..."
+_CONTACT_RE = re.compile(r'@|^(?i:tel|phone|fax)|^\+?\d[^A-Za-z]*$')
+
+
 def extract_bol_consignee_by_regex(document) -> Optional[str]:
     """
     Fallback: extract consignee block purely from text,
@@ -621,22 +801,12 @@ def extract_bol_consignee_by_regex(document) -> Optional[str]:
     """
     text = document.text
 
-    m = re.search(
-        r'Consignee[^\n]*\n(.*?)(?=\nNotify Party)',  # stop right before the next 'Notify Party' line
-        text,
-        re.IGNORECASE | re.DOTALL,
-    )
+    m = _CONSIGNEE_RE.search(text)
     if not m:
         return None
 
     block = m.group(1).strip()
 
-    # Lines we *never* want in consignee details
-    EXCLUDE_PATTERNS = [
-        r"As principal, where",   # the exact junk line you showed
-        r"care of",               # catches "care of", "c/o", etc if they appear elsewhere
-    ]
-
     cleaned_lines = []
     for ln in block.splitlines():
         s = ln.strip()
@@ -644,7 +814,7 @@ def extract_bol_consignee_by_regex(document) -> Optional[str]:
             continue
 
         # Skip any line that matches one of our exclude patterns
-        if any(re.search(pat, s, re.IGNORECASE) for pat in EXCLUDE_PATTERNS):
+        if _CONSIGNEE_EXCLUDE_RE.search(s):
             continue
 
         cleaned_lines.append(s)
@@ -714,11 +884,7 @@ def extract_bol_notify_by_regex(document) -> Optional[str]:
     """
     text = document.text
 
-    m = re.search(
-        r'Notify Party\s*\(see clause 22\)[^\n]*\n(.*?)(?=\nVessel\b|\nVessel\s*\(see|\Z)',
-        text,
-        re.IGNORECASE | re.DOTALL,
-    )
+    m = _NOTIFY_RE.search(text)
     if not m:
         return None
 
@@ -726,6 +892,23 @@ def extract_bol_notify_by_regex(document) -> Optional[str]:
     lines = [ln.strip() for ln in block.splitlines() if ln.strip()]
     return "\n".join(lines) if lines else None
 
+# Obviously non-vessel words; matched as substrings of the lowercased name
+VESSEL_JUNK_KEYWORDS = (
+    "payment",
+    "precondition",
+    "preconditions",
+    "support",
+    "customer",
+    "reference(s)",
+    "verify copy approval",
+    "maersk.com",
+    "http",
+    "https",
+    "details available here",
+)
+_VESSEL_JUNK_RE = re.compile("|".join(map(re.escape, VESSEL_JUNK_KEYWORDS)))
+
+
 def is_plausible_vessel_name(name: Optional[str]) -> bool:
     """
     Heuristic check to see if a vessel name looks reasonable.
@@ -744,21 +927,7 @@ def is_plausible_vessel_name(name: Optional[str]) -> bool:
     if len(s) > 40:
         return False
 
-    junk_keywords = [
-        "payment",
-        "precondition",
-        "preconditions",
-        "support",
-        "customer",
-        "reference(s)",
-        "verify copy approval",
-        "maersk.com",
-        "http",
-        "https",
-        "details available here",
-    ]
-    lower_s = s.lower()
-    if any(k in lower_s for k in junk_keywords):
+    if _VESSEL_JUNK_RE.search(s.lower()):
         return False
 
     return True
@@ -774,11 +943,7 @@ def extract_bol_vessel_voyage_regex(document) -> Dict[str, Optional[str]]:
     result = {"vessel_name": None, "voyage": None}
 
     # --- Vessel name: line between 'Vessel' and 'Voyage' (original logic) ---
-    m_vessel_block = re.search(
-        r"Vessel[^\n]*\n([^\n]+)\n\s*Voyage",
-        text,
-        re.IGNORECASE,
-    )
+    m_vessel_block = _VESSEL_BLOCK_RE.search(text)
     if m_vessel_block:
         vessel_candidate = m_vessel_block.group(1).strip()
         if vessel_candidate:
@@ -786,30 +951,23 @@ def extract_bol_vessel_voyage_regex(document) -> Dict[str, Optional[str]]:
 
     # --- Voyage: try to find a code near the 'Voyage' header ---
 
-    lines = text.splitlines()
     voyage_code: Optional[str] = None
 
     # Attempt 1: look at the line immediately after 'Voyage No.'
-    m_voy = re.search(
-        r"Voyage\s*No\.?\s*\n([^\n]+)",
-        text,
-        re.IGNORECASE,
-    )
+    m_voy = _VOYAGE_NO_RE.search(text)
     if m_voy:
         raw_after_voy = m_voy.group(1).strip()
         voyage_code = find_voyage_code_final(raw_after_voy)
 
     # Attempt 2: if that failed (e.g. line is 'MAERSK FELIXSTOWE'), scan a small window
     if voyage_code is None:
-        idx = None
-        for i, line in enumerate(lines):
-            if re.search(r"\bVoyage\b", line, re.IGNORECASE):
-                idx = i
-                break
-
-        if idx is not None:
+        # The first match in the full text sits on the first line that has one,
+        # so only the text from there on needs splitting into lines
+        m_header = _VOYAGE_WORD_RE.search(text)
+        if m_header:
+            lines_from_header = text[m_header.start():].splitlines()
             # Look at the next ~5 lines after the 'Voyage' header
-            window_text = " ".join(lines[idx + 1: idx + 6])
+            window_text = " ".join(lines_from_header[1:6])
             voyage_code = find_voyage_code_final(window_text)
 
     if voyage_code:
@@ -832,19 +990,8 @@ def clean_exporter_address_block(block: Optional[str]) -> Optional[str]:
         if not s:
             continue
 
-        lower = s.lower()
-
-        # Drop obvious contact / comms lines
-        if '@' in s:
-            continue
-        if lower.startswith("tel") or lower.startswith("tel:"):
-            continue
-        if lower.startswith("phone") or lower.startswith("phone:"):
-            continue
-        if lower.startswith("fax") or lower.startswith("fax:"):
-            continue
-        # Lines that are just a phone number like "+27 ..." etc.
-        if re.match(r'^\+?\d', s) and not re.search(r'[A-Za-z]', s):
+        # Drop obvious contact / comms lines in one pass
+        if _CONTACT_RE.search(s):
             continue
 
         cleaned_lines.append(s)
@@ -859,22 +1006,14 @@ def extract_bol_shipper_by_regex(document) -> Optional[str]:
     text = document.text
 
     # Capture everything after the Shipper header up to the Consignee header
-    m = re.search(
-        r"Shipper\s*\(.*?\)[^\n]*\n(.*?)(?=\nConsignee\s*\(|\nNotify Party|\nThis contract is subject)",
-        text,
-        re.IGNORECASE | re.DOTALL,
-    )
+    m = _SHIPPER_RE.search(text)
     if not m:
         return None
 
     block = m.group(1).strip()
 
-    # Drop lines we know are not part of the postal address
-    EXCLUDE_PREFIXES = [
-        r"Booking No\.?", 
-        r"Export references",
-        r"Svc Contract",
-    ]
+    # Drop lines we know are not part of the postal address (lowercase prefixes)
+    EXCLUDE_PREFIXES = ("booking no", "export references", "svc contract")
 
     cleaned_lines = []
     for ln in block.splitlines():
@@ -883,7 +1022,7 @@ def extract_bol_shipper_by_regex(document) -> Optional[str]:
             continue
 
         # Skip noisy lines like "Export references", "Svc Contract", etc.
-        if any(re.match(pat, s, re.IGNORECASE) for pat in EXCLUDE_PREFIXES):
+        if s.lower().startswith(EXCLUDE_PREFIXES):
             continue
 
         cleaned_lines.append(s)
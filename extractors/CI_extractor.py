@@ -1,8 +1,20 @@
 from typing import Optional, Dict, List, Tuple, Any
 import re
+import numpy as np
 from google.cloud import documentai
 
 
+# Patterns used on every document, compiled once at import
+_PAREN_NUM_RE = re.compile(r'\((\d+)\)')
+# r'Total Gross Mass \[kg\]' -> Matches the literal text. Brackets must be escaped with \.
+# \s* -> Matches zero or more whitespace characters.
+# ([\d.]+) -> This is the capture group. It matches and captures one or more digits or dots.
+_GROSS_MASS_RE = re.compile(r'Total Gross Mass \[kg\]\s*([\d.]+)')
+_NET_MASS_RE = re.compile(r'Total Net Mass \[kg\]\s*([\d.]+)')
+# A bare mass value, as captured by the two patterns above
+_MASS_VALUE_RE = re.compile(r'[\d.]+')
+
+
 def get_text(text_anchor: dict, text: str) -> str:
     """
     Document AI's text anchor maps to a part of the full text.
@@ -17,6 +29,83 @@ def get_text(text_anchor: dict, text: str) -> str:
     return text[start_index:end_index]
 
 
+class PageIndex:
+    """
+    Line bounding boxes for one page, computed once and kept as NumPy columns
+    (min_x, min_y, max_x, max_y, cx) so the spatial extractors below can select
+    lines with vectorised masks instead of re-scanning every line's vertices.
+    The document text is kept too, and each line's stripped text (and its
+    lowercase form) is sliced out of it once and kept alongside, indexed
+    like `lines`.
+    Line indices are also kept sorted by top edge, so "lines below y" is a
+    binary search (see lines_below). Lines without vertices get NaN extents
+    and so never pass a filter.
+    """
+    __slots__ = (
+        "page", "document_text", "lines", "texts", "texts_lower",
+        "min_x", "min_y", "max_x", "max_y", "cx",
+        "order_by_min_y", "min_y_sorted",
+    )
+
+    def __init__(self, page, document_text: str):
+        self.page = page
+        self.document_text = document_text
+        lines = self.lines = list(page.lines)
+        texts = self.texts = []
+        texts_lower = self.texts_lower = []
+        vertex_lists = []
+        for line in lines:
+            layout = line.layout
+            text = get_text(layout.text_anchor, document_text).strip()
+            texts.append(text)
+            texts_lower.append(text.lower())
+            vertex_lists.append(layout.bounding_poly.normalized_vertices)
+        if all(len(vs) == 4 for vs in vertex_lists):
+            # Pack every quad into one (N, 4, 2) array and reduce the whole page at once
+            coords = np.fromiter(
+                (c for vs in vertex_lists for v in vs for c in (v.x, v.y)),
+                dtype=np.float64, count=8 * len(vertex_lists),
+            ).reshape(-1, 4, 2)
+            mins = coords.min(axis=1)
+            maxs = coords.max(axis=1)
+        else:
+            mins = np.full((len(lines), 2), np.nan)
+            maxs = np.full((len(lines), 2), np.nan)
+            for i, vs in enumerate(vertex_lists):
+                if vs:
+                    xs = [v.x for v in vs]
+                    ys = [v.y for v in vs]
+                    mins[i] = (min(xs), min(ys))
+                    maxs[i] = (max(xs), max(ys))
+        self.min_x, self.min_y = mins.T.copy()
+        self.max_x, self.max_y = maxs.T.copy()
+        self.cx = (self.min_x + self.max_x) / 2.0
+        # Stable, so lines sharing a top edge stay in line order; NaNs sort last and are dropped
+        order = np.argsort(self.min_y, kind="stable")
+        self.order_by_min_y = order[:np.count_nonzero(~np.isnan(self.min_y))]
+        self.min_y_sorted = self.min_y[self.order_by_min_y]
+
+
+def page_index_for(document, page_index: Optional[PageIndex] = None) -> Optional[PageIndex]:
+    """Returns page_index if given, else a PageIndex for the document's first page (None without pages)."""
+    if page_index is not None:
+        return page_index
+    pages = document.pages
+    return PageIndex(pages[0], document.text) if pages else None
+
+
+def sort_by_top(index: PageIndex, idxs) -> List[int]:
+    """Orders line indices top to bottom; lines sharing a top edge keep their given order."""
+    idxs = np.asarray(idxs, dtype=np.intp)
+    return idxs[np.argsort(index.min_y[idxs], kind="stable")].tolist()
+
+
+def lines_below(index: PageIndex, y: float) -> np.ndarray:
+    """Returns the indices of the lines whose top edge is below y, ordered top to bottom."""
+    start = np.searchsorted(index.min_y_sorted, y, side="right")
+    return index.order_by_min_y[start:]
+
+
 def extract_invoice_data(document: documentai.Document) -> Dict[str, Any]:
     """
     Extracts key fields from a Document AI processed invoice.
@@ -28,8 +117,9 @@ def extract_invoice_data(document: documentai.Document) -> Dict[str, Any]:
     
     # 1. Create a dictionary from the Form Parser's easy findings
     # This makes lookup much faster than looping every time.
+    pages = document.pages
     form_data = {}
-    for page in document.pages:
+    for page in pages:
         for field in page.form_fields:
             key = get_text(field.field_name.text_anchor, document_text).strip().lower()
             value = get_text(field.field_value.text_anchor, document_text).strip()
@@ -52,13 +142,16 @@ def extract_invoice_data(document: documentai.Document) -> Dict[str, Any]:
         "banking_details": None
     }
 
-    total_cartons = extract_total_cartons_from_header_text(document) 
+    # Line geometry of the first page, shared by all the spatial extractors
+    page_index = PageIndex(pages[0], document_text) if pages else None
+
+    total_cartons = extract_total_cartons_from_header_text(document, document_text)
     if not total_cartons:
-        total_cartons = extract_cartons_spatially_by_header_anchor(document)
+        total_cartons = extract_cartons_spatially_by_header_anchor(document, page_index)
 
     # 3. Populate structure using the form_data and extraction fucntions
-    extracted_data["exporter_address"] = extract_exporter_address(document)
-    party_details = extract_all_party_details(document)
+    extracted_data["exporter_address"] = extract_exporter_address(document, page_index)
+    party_details = extract_all_party_details(document, page_index)
     extracted_data["consignee_details"] = party_details.get("consignee_details")
     extracted_data["invoice_party_details"] = party_details.get("invoice_party_details")
     extracted_data["notify_party_details"] = party_details.get("notify_party_details")
@@ -68,10 +161,17 @@ def extract_invoice_data(document: documentai.Document) -> Dict[str, Any]:
     extracted_data["port_of_destination"] = form_data.get("port of destination")
     extracted_data["total_value"] = form_data.get("total value:")
     extracted_data["total_cartons"] = total_cartons
-    mass_totals = extract_mass_totals_by_regex(document)
+    # Skip the full-text regex scan when the Form Parser already paired both
+    # mass labels with a clean number
+    form_gross = form_data.get("total gross mass [kg]")
+    form_net = form_data.get("total net mass [kg]")
+    if form_gross and form_net and _MASS_VALUE_RE.fullmatch(form_gross) and _MASS_VALUE_RE.fullmatch(form_net):
+        mass_totals = {"gross": form_gross, "net": form_net}
+    else:
+        mass_totals = extract_mass_totals_by_regex(document, document_text)
     extracted_data["total_gross_mass_kg"] = mass_totals.get("gross")
     extracted_data["total_net_mass_kg"] = mass_totals.get("net")
-    extracted_data["banking_details"] = extract_banking_details(document)
+    extracted_data["banking_details"] = extract_banking_details(document, page_index)
 
     return extracted_data
       
@@ -90,94 +190,76 @@ def get_block_center_x(block):
     return (min(v.x for v in vertices) + max(v.x for v in vertices)) / 2
 
       
-def extract_exporter_address(document: dict) -> Optional[str]:
+def extract_exporter_address(document: dict, page_index: Optional[PageIndex] = None) -> Optional[str]:
     """
     Finds the exporter address by establishing a
     strict left boundary and a flexible center-point alignment based on the
     'Reg No' anchor, then uses gap analysis to find the block's top.
     """
-    if not document.pages:
+    index = page_index_for(document, page_index)
+    if index is None:
         return None
 
-    page = document.pages[0]
-    document_text = document.text
-
     # --- Step 1: Find the most reliable bottom anchor ---
-    bottom_anchor_line = find_line_by_substring(page, "Reg No", document_text)
-    if not bottom_anchor_line:
+    anchor_idx = find_line_index_by_substring(index, "Reg No")
+    if anchor_idx is None:
         print("Could not find 'Reg No' anchor line.")
         return None
     
     # --- Step 2: Define a HYBRID boundary based on the anchor ---
-    bottom_anchor_bbox = bottom_anchor_line.layout.bounding_poly
-    
     # A. The strict left boundary to exclude the logo
-    strict_left_boundary_x = min(v.x for v in bottom_anchor_bbox.normalized_vertices) - 0.02 # Add small tolerance
+    strict_left_boundary_x = index.min_x[anchor_idx] - 0.02 # Add small tolerance
     
     # B. The center of the column for flexible alignment
-    column_center_x = (min(v.x for v in bottom_anchor_bbox.normalized_vertices) + max(v.x for v in bottom_anchor_bbox.normalized_vertices)) / 2.0
+    column_center_x = index.cx[anchor_idx]
     horizontal_tolerance = 0.1 # Allow line centers to be within 10% of the page width
     
-    bottom_anchor_top_y = min(v.y for v in bottom_anchor_bbox.normalized_vertices)
+    bottom_anchor_top_y = index.min_y[anchor_idx]
     print(f"Defined left boundary at x > {strict_left_boundary_x:.3f} and center near x={column_center_x:.3f}")
 
     # --- Step 3: Gather candidate lines using the hybrid boundary ---
-    candidate_lines = [bottom_anchor_line]
-    for line in page.lines:
-        if line == bottom_anchor_line:
-            continue
-
-        line_bbox = line.layout.bounding_poly
-        line_center_x = (
-            min(v.x for v in line_bbox.normalized_vertices)
-            + max(v.x for v in line_bbox.normalized_vertices)
-        ) / 2.0
-        line_bottom_y = max(v.y for v in line_bbox.normalized_vertices)
-
-        # 1) Above the Reg No line
-        is_above = line_bottom_y < bottom_anchor_top_y
-        # 2) Reasonably within the same column
-        is_centered = abs(line_center_x - column_center_x) < horizontal_tolerance
-
-        if is_above and is_centered:
-            candidate_lines.append(line)
-
-    if len(candidate_lines) < 2:
+    # 1) Above the Reg No line
+    above = np.flatnonzero(index.max_y < bottom_anchor_top_y)
+    # 2) Reasonably within the same column (only checked for the lines above)
+    centered = above[np.abs(index.cx[above] - column_center_x) < horizontal_tolerance]
+    candidate_idxs = [anchor_idx] + centered[centered != anchor_idx].tolist()
+
+    if len(candidate_idxs) < 2:
         print("Could not find sufficient address lines above 'Reg No'.")
-        return get_text(bottom_anchor_line.layout.text_anchor, document_text).strip()
+        return index.texts[anchor_idx]
 
     # Step 4 & 5: Sort, prune with gap analysis, and format
-    candidate_lines.sort(key=lambda l: min(v.y for v in l.layout.bounding_poly.normalized_vertices))
+    min_y, max_y = index.min_y, index.max_y
+    candidate_idxs = sort_by_top(index, candidate_idxs)
     
     vertical_gap_threshold = 0.015
-    final_block_lines = [candidate_lines[-1]]
+    final_block_idxs = [candidate_idxs[-1]]
 
-    for i in range(len(candidate_lines) - 2, -1, -1):
-        current_line, line_below = candidate_lines[i], candidate_lines[i+1]
-        current_bottom_y = max(v.y for v in current_line.layout.bounding_poly.normalized_vertices)
-        below_top_y = min(v.y for v in line_below.layout.bounding_poly.normalized_vertices)
+    for i in range(len(candidate_idxs) - 2, -1, -1):
+        current_idx, below_idx = candidate_idxs[i], candidate_idxs[i+1]
         
-        if (below_top_y - current_bottom_y) > vertical_gap_threshold:
-            print(f"Detected large vertical gap above line: '{get_text(current_line.layout.text_anchor, document_text).strip()}'")
+        if (min_y[below_idx] - max_y[current_idx]) > vertical_gap_threshold:
+            print(f"Detected large vertical gap above line: '{index.texts[current_idx]}'")
             break
         
-        final_block_lines.append(current_line)
+        final_block_idxs.append(current_idx)
     
-    final_block_lines.reverse()
+    final_block_idxs.reverse()
     
-    final_text_lines = [get_text(l.layout.text_anchor, document_text).strip() for l in final_block_lines]
+    final_text_lines = [index.texts[i] for i in final_block_idxs]
              
     return "\n".join(final_text_lines)
 
     
     
 
-def extract_total_cartons_from_header_text(document: dict) -> Optional[str]:
+def extract_total_cartons_from_header_text(document: dict, document_text: Optional[str] = None) -> Optional[str]:
     """
     Extracts the total cartons by analyzing the full text of the table's
     header section, which is robust against messy OCR joining header lines.
     """
-    document_text = document.text
+    if document_text is None:
+        document_text = document.text
 
     for page in document.pages:
         for table in page.tables:
@@ -194,7 +276,7 @@ def extract_total_cartons_from_header_text(document: dict) -> Optional[str]:
             contains_cartons_keyword = "Cartons" in full_header_text
             
             # Find a number in parentheses
-            match = re.search(r'\((\d+)\)', full_header_text)
+            match = _PAREN_NUM_RE.search(full_header_text)
             
             if contains_cartons_keyword and match:
                 total_cartons = match.group(1)
@@ -204,88 +286,70 @@ def extract_total_cartons_from_header_text(document: dict) -> Optional[str]:
     print("Could not find both 'Cartons' and a value in parentheses in any table header.")
     return None
     
-def find_line_by_substring(page, substring: str, document_text: str):
-    """Finds the first line on a page containing a specific substring."""
-    for line in page.lines:
-        line_text = get_text(line.layout.text_anchor, document_text)
+def find_line_index_by_substring(index: PageIndex, substring: str) -> Optional[int]:
+    """Returns the position in index.lines of the first line containing the substring, or None."""
+    for i, line_text in enumerate(index.texts):
         if substring in line_text:
-            return line
+            return i
     return None
 
-def extract_cartons_spatially_by_header_anchor(document: dict) -> Optional[str]:
+def extract_cartons_spatially_by_header_anchor(document: dict, page_index: Optional[PageIndex] = None) -> Optional[str]:
     """
     Finds the total cartons value by spatially locating the 'Cartons'
     header text and then finding the value in parentheses directly below it.
     This method does NOT rely on the document's table entities.
     """
-    if not document.pages:
+    index = page_index_for(document, page_index)
+    if index is None:
         return None
-        
-    page = document.pages[0]
-    document_text = document.text
 
     # Step 1: Find the 'Cartons' header line itself
-    cartons_header_line = find_line_by_substring(page, "Cartons", document_text)
+    header_idx = find_line_index_by_substring(index, "Cartons")
     
-    if not cartons_header_line:
+    if header_idx is None:
         print("Could not find a line containing 'Cartons' on the page.")
         return None
         
     # Step 2: Get the header's coordinates to define our search area
-    header_bbox = cartons_header_line.layout.bounding_poly
-    header_left_x = min(v.x for v in header_bbox.normalized_vertices)
-    header_right_x = max(v.x for v in header_bbox.normalized_vertices)
-    header_bottom_y = max(v.y for v in header_bbox.normalized_vertices)
+    header_left_x = index.min_x[header_idx]
+    header_right_x = index.max_x[header_idx]
+    header_bottom_y = index.max_y[header_idx]
     print(f"Found 'Cartons' header line. Searching for value below y={header_bottom_y:.3f} and between x=({header_left_x:.3f}, {header_right_x:.3f})")
 
     # Step 3: Search all other lines for the value
-    for line in page.lines:
-        # Don't check the header line itself
-        if line == cartons_header_line:
-            continue
-
-        line_bbox = line.layout.bounding_poly
-        line_top_y = min(v.y for v in line_bbox.normalized_vertices)
-        line_center_x = (min(v.x for v in line_bbox.normalized_vertices) + max(v.x for v in line_bbox.normalized_vertices)) / 2.0
-
-        # Condition 1: Must be below the header
-        is_below = line_top_y > header_bottom_y
-        
-        # Condition 2: Must be horizontally aligned in the same column
-        is_aligned = header_left_x < line_center_x < header_right_x
-
-        if is_below and is_aligned:
-            line_text = get_text(line.layout.text_anchor, document_text)
-            match = re.search(r'\((\d+)\)', line_text)
-            if match:
-                total_cartons = match.group(1)
-                print(f"SUCCESS: Found aligned line '{line_text.strip()}' and extracted value: {total_cartons}")
-                return total_cartons
+    # Condition 1: Must be below the header
+    below = lines_below(index, header_bottom_y)
+    # Condition 2: Must be horizontally aligned in the same column
+    cx = index.cx[below]
+    aligned = below[(header_left_x < cx) & (cx < header_right_x)]
+    # Don't check the header line itself; keep page order so the first match wins as before
+    aligned = np.sort(aligned[aligned != header_idx])
+
+    for i in aligned:
+        line_text = index.texts[i]
+        match = _PAREN_NUM_RE.search(line_text)
+        if match:
+            total_cartons = match.group(1)
+            print(f"SUCCESS: Found aligned line '{line_text}' and extracted value: {total_cartons}")
+            return total_cartons
 
     print("Could not spatially locate a value in parentheses below the 'Cartons' header line.")
     return None
 
-def extract_mass_totals_by_regex(document: dict) -> Dict[str, Optional[str]]:
+def extract_mass_totals_by_regex(document: dict, document_text: Optional[str] = None) -> Dict[str, Optional[str]]:
     """
     Finds the total gross and net mass by searching the entire document text
     for specific patterns using regular expressions.
 
     Returns a dictionary with 'gross' and 'net' keys.
     """
-    full_text = document.text
+    full_text = document.text if document_text is None else document_text
     
     gross_mass = None
     net_mass = None
 
-    # --- Define the Regex Patterns ---
-    # r'Total Gross Mass \[kg\]' -> Matches the literal text. Brackets must be escaped with \.
-    # \s* -> Matches zero or more whitespace characters.
-    # ([\d.]+) -> This is the capture group. It matches and captures one or more digits or dots.
-    gross_mass_pattern = r'Total Gross Mass \[kg\]\s*([\d.]+)'
-    net_mass_pattern = r'Total Net Mass \[kg\]\s*([\d.]+)'
-
     # Search for Gross Mass
-    gross_match = re.search(gross_mass_pattern, full_text)
+    gross_match = _GROSS_MASS_RE.search(full_text)
     if gross_match:
         gross_mass = gross_match.group(1) # group(1) is our captured number
         print(f"SUCCESS: Found Gross Mass using regex: {gross_mass}")
@@ -293,7 +357,7 @@ def extract_mass_totals_by_regex(document: dict) -> Dict[str, Optional[str]]:
         print("Could not find Total Gross Mass using regex.")
 
     # Search for Net Mass
-    net_match = re.search(net_mass_pattern, full_text)
+    net_match = _NET_MASS_RE.search(full_text)
     if net_match:
         net_mass = net_match.group(1)
         print(f"SUCCESS: Found Net Mass using regex: {net_mass}")
@@ -310,54 +374,97 @@ def _process_party_column(candidates: List[Tuple[float, str]]) -> Optional[str]:
     """
     if not candidates:
         return None
-    candidates.sort(key=lambda item: item[0])
+    ys = np.array([y_pos for y_pos, _ in candidates])
+    order = np.argsort(ys, kind="stable")
 
     vertical_gap_threshold = 0.03
-    final_lines = [candidates[0][1]]
-    last_y_pos = candidates[0][0]
-
-    for i in range(1, len(candidates)):
-        current_y_pos, current_text = candidates[i]
-        if (current_y_pos - last_y_pos) > vertical_gap_threshold:
-            print(f"Detected large vertical gap. Stopping column search.")
-            break
-        final_lines.append(current_text)
-        last_y_pos = current_y_pos
-    return "\n".join(final_lines)
+    # Keep everything up to the first gap between consecutive lines that is too large
+    large_gaps = np.flatnonzero(np.diff(ys[order]) > vertical_gap_threshold)
+    end = len(order)
+    if len(large_gaps):
+        print(f"Detected large vertical gap. Stopping column search.")
+        end = large_gaps[0] + 1
+    return "\n".join([candidates[i][1] for i in order[:end].tolist()])
 
 
-def get_char_positions(line, page_tokens: list, document_text: str) -> List[Tuple[str, float]]:
+class TokenIndex:
+    """
+    A page's tokens ordered by the start of their text segment, so the tokens
+    inside a line's text span can be found by binary search (see
+    tokens_in_span) instead of filtering every token on the page for each line.
+    Tokens without a text segment can never fall inside a line and are left out.
+    """
+    __slots__ = ("tokens", "order", "starts", "ends")
+
+    def __init__(self, page_tokens):
+        tokens = self.tokens = list(page_tokens)
+        spans = [
+            (i, int(t.layout.text_anchor.text_segments[0].start_index), int(t.layout.text_anchor.text_segments[0].end_index))
+            for i, t in enumerate(tokens) if t.layout.text_anchor.text_segments
+        ]
+        positions, starts, ends = np.array(spans, dtype=np.int64).reshape(-1, 3).T
+        # Stable, so tokens starting at the same offset stay in page order
+        by_start = np.argsort(starts, kind="stable")
+        self.order = positions[by_start]
+        self.starts = starts[by_start]
+        self.ends = ends[by_start]
+
+
+def tokens_in_span(token_index: TokenIndex, start: int, end: int) -> list:
+    """Returns the tokens whose text segment lies within [start, end], in page order."""
+    lo = np.searchsorted(token_index.starts, start, side="left")
+    hi = np.searchsorted(token_index.starts, end, side="right")
+    inside = token_index.order[lo:hi][token_index.ends[lo:hi] <= end]
+    return [token_index.tokens[i] for i in np.sort(inside).tolist()]
+
+
+def get_char_positions(line, page_tokens: list, document_text: str, token_index: Optional[TokenIndex] = None) -> List[Tuple[str, float]]:
     positions = []
     if not line.layout.text_anchor.text_segments: return positions
     line_start, line_end = line.layout.text_anchor.text_segments[0].start_index, line.layout.text_anchor.text_segments[0].end_index
-    line_tokens = [t for t in page_tokens if t.layout.text_anchor.text_segments and t.layout.text_anchor.text_segments[0].start_index >= line_start and t.layout.text_anchor.text_segments[0].end_index <= line_end]
+    if token_index is not None:
+        line_tokens = tokens_in_span(token_index, int(line_start), int(line_end))
+    else:
+        line_tokens = [t for t in page_tokens if t.layout.text_anchor.text_segments and t.layout.text_anchor.text_segments[0].start_index >= line_start and t.layout.text_anchor.text_segments[0].end_index <= line_end]
+    token_texts, start_xs, widths = [], [], []
     for token in line_tokens:
         token_text = get_text(token.layout.text_anchor, document_text)
         if not token_text: continue
         bbox = token.layout.bounding_poly
         start_x, end_x = min(v.x for v in bbox.normalized_vertices), max(v.x for v in bbox.normalized_vertices)
-        width = end_x - start_x
-        for i, char in enumerate(token_text):
-            positions.append((char, start_x + (i / len(token_text)) * width if len(token_text) > 0 else 0))
-    positions.sort(key=lambda item: item[1])
+        token_texts.append(token_text)
+        start_xs.append(start_x)
+        widths.append(end_x - start_x)
+    if not token_texts: return positions
+
+    # Spread each token's characters evenly across its width, for all tokens at once
+    lengths = np.array([len(t) for t in token_texts])
+    owner = np.repeat(np.arange(len(lengths)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    char_xs = np.array(start_xs)[owner] + (offsets / lengths[owner]) * np.array(widths)[owner]
+
+    # Stable, so characters at the same x keep their original order
+    order = np.argsort(char_xs, kind="stable")
+    chars = "".join(token_texts)
+    positions = list(zip([chars[i] for i in order.tolist()], char_xs[order].tolist()))
     return positions
 
 
-def extract_all_party_details(document: dict) -> Dict[str, Optional[str]]:
+def extract_all_party_details(document: dict, page_index: Optional[PageIndex] = None) -> Dict[str, Optional[str]]:
     """
     Detects the number of party headers and chooses the appropriate parsing strategy.
     """
     results = {"consignee_details": None, "invoice_party_details": None, "notify_party_details": None}
-    if not document.pages: return results
-        
-    page = document.pages[0]
-    document_text = document.text
+    index = page_index_for(document, page_index)
+    if index is None: return results
+    page = index.page
+    lines = index.lines
     page_tokens = page.tokens
 
     # Step 1: Discover available anchors
     party_keywords = { "consignee_details": "Consignee", "invoice_party_details": "Invoice Party", "notify_party_details": "Notify Party" }
-    found_anchors = { key: find_line_by_substring(page, keyword, document_text) for key, keyword in party_keywords.items() }
-    present_anchors = sorted([(key, anchor) for key, anchor in found_anchors.items() if anchor], key=lambda item: min(v.x for v in item[1].layout.bounding_poly.normalized_vertices))
+    found_anchors = { key: find_line_index_by_substring(index, keyword) for key, keyword in party_keywords.items() }
+    present_anchors = sorted([(key, anchor_idx) for key, anchor_idx in found_anchors.items() if anchor_idx is not None], key=lambda item: index.min_x[item[1]])
     
     if not present_anchors:
         print("No party detail anchors found on the page.")
@@ -365,21 +472,24 @@ def extract_all_party_details(document: dict) -> Dict[str, Optional[str]]:
 
     # Initialize the candidate buckets using the final, correct keys
     candidates = {key: [] for key in party_keywords.keys()}
-    anchor_bottom_y = max(max(v.y for v in anchor.layout.bounding_poly.normalized_vertices) for _, anchor in present_anchors)
+    anchor_bottom_y = max(index.max_y[anchor_idx] for _, anchor_idx in present_anchors)
+    # Page order, which is the order the candidates were collected in before
+    below_anchors = np.sort(lines_below(index, anchor_bottom_y))
 
     # Step 2: Branch logic based on the number of headers found
 
     # LOGIC FOR MULTI-COLUMN LAYOUTS
     if len(present_anchors) >= 2:
         print(f"Detected {len(present_anchors)} headers. Using multi-column re-slicing logic.")
+        # Tokens are looked up per line below, so order them by text offset once
+        token_index = TokenIndex(page_tokens)
         boundaries = {}
-        for i, (key, anchor) in enumerate(present_anchors):
-            right_bound = min(v.x for v in present_anchors[i+1][1].layout.bounding_poly.normalized_vertices) if i + 1 < len(present_anchors) else 1.0
+        for i, (key, anchor_idx) in enumerate(present_anchors):
+            right_bound = index.min_x[present_anchors[i+1][1]] if i + 1 < len(present_anchors) else 1.0
             boundaries[key] = {'right': right_bound}
         
-        for line in page.lines:
-            if min(v.y for v in line.layout.bounding_poly.normalized_vertices) <= anchor_bottom_y: continue
-            char_positions = get_char_positions(line, page_tokens, document_text)
+        for i in below_anchors:
+            char_positions = get_char_positions(lines[i], page_tokens, index.document_text, token_index)
             if not char_positions: continue
             
             line_buckets = {key: "" for key, _ in present_anchors}
@@ -395,26 +505,20 @@ def extract_all_party_details(document: dict) -> Dict[str, Optional[str]]:
                     line_buckets[present_anchors[-1][0]] += char
             
             for key, text in line_buckets.items():
-                 if text.strip(): candidates[key].append((min(v.y for v in line.layout.bounding_poly.normalized_vertices), text.strip()))
+                 if text.strip(): candidates[key].append((index.min_y[i], text.strip()))
 
     # LOGIC FOR SINGLE-COLUMN LAYOUTS
     elif len(present_anchors) == 1:
-        key, anchor = present_anchors[0]
+        key, anchor_idx = present_anchors[0]
         print(f"Detected 1 header ('{party_keywords[key]}'). Using single-column logic.")
         
-        anchor_bbox = anchor.layout.bounding_poly
-        column_center_x = (min(v.x for v in anchor_bbox.normalized_vertices) + max(v.x for v in anchor_bbox.normalized_vertices)) / 2.0
+        column_center_x = index.cx[anchor_idx]
+        in_column = below_anchors[np.abs(index.cx[below_anchors] - column_center_x) < 0.2]
         
-        for line in page.lines:
-            if min(v.y for v in line.layout.bounding_poly.normalized_vertices) <= anchor_bottom_y: continue
-            
-            line_bbox = line.layout.bounding_poly
-            line_center_x = (min(v.x for v in line_bbox.normalized_vertices) + max(v.x for v in line_bbox.normalized_vertices)) / 2.0
-            
-            if abs(line_center_x - column_center_x) < 0.2:
-                 text = get_text(line.layout.text_anchor, document_text).strip()
-                 if text:
-                    candidates[key].append((min(v.y for v in line.layout.bounding_poly.normalized_vertices), text))
+        for i in in_column:
+            text = index.texts[i]
+            if text:
+                candidates[key].append((index.min_y[i], text))
 
     # Step 3: Final Processing for all found candidates
     for key, candidate_list in candidates.items():
@@ -425,75 +529,69 @@ def extract_all_party_details(document: dict) -> Dict[str, Optional[str]]:
     return results
 
 
-def _extract_banking_details_by_header(document: dict) -> Optional[str]:
+def _extract_banking_details_by_header(document: dict, page_index: Optional[PageIndex] = None) -> Optional[str]:
     """
     Strategy 1: Finds the 'Banking Details:' header and extracts the text block below it.
     """
-    if not document.pages:
+    index = page_index_for(document, page_index)
+    if index is None:
         return None
-        
-    page = document.pages[0]
-    document_text = document.text
 
-    anchor_line = find_line_by_substring(page, "Banking Details:", document_text)
-    if not anchor_line:
+    anchor_idx = find_line_index_by_substring(index, "Banking Details:")
+    if anchor_idx is None:
         return None 
         
-    anchor_bbox = anchor_line.layout.bounding_poly
-    anchor_center_x = (min(v.x for v in anchor_bbox.normalized_vertices) + max(v.x for v in anchor_bbox.normalized_vertices)) / 2.0
+    anchor_center_x = index.cx[anchor_idx]
     column_tolerance = 0.20
     search_left_x, search_right_x = anchor_center_x - column_tolerance, anchor_center_x + column_tolerance
-    anchor_bottom_y = max(v.y for v in anchor_bbox.normalized_vertices)
+    anchor_bottom_y = index.max_y[anchor_idx]
     print(f"Found 'Banking Details:' anchor. Searching for lines below y={anchor_bottom_y:.3f} and within x=({search_left_x:.3f}, {search_right_x:.3f})")
 
-    candidate_lines_with_pos = []
-    for line in page.lines:
-        if line == anchor_line or not line.layout.bounding_poly.normalized_vertices: continue
-        line_top_y = min(v.y for v in line.layout.bounding_poly.normalized_vertices)
-        if line_top_y <= anchor_bottom_y: continue
-        
-        line_center_x = (min(v.x for v in line.layout.bounding_poly.normalized_vertices) + max(v.x for v in line.layout.bounding_poly.normalized_vertices)) / 2.0
-        if search_left_x < line_center_x < search_right_x:
-            candidate_lines_with_pos.append((line_top_y, line))
+    # Already ordered top to bottom (ties in page order)
+    below = lines_below(index, anchor_bottom_y)
+    cx = index.cx[below]
+    candidate_idxs = below[(search_left_x < cx) & (cx < search_right_x) & (below != anchor_idx)].tolist()
 
-    if not candidate_lines_with_pos: return None
+    if not candidate_idxs: return None
         
-    candidate_lines_with_pos.sort(key=lambda item: item[0])
+    min_y, max_y = index.min_y, index.max_y
 
     vertical_gap_threshold = 0.02
     final_lines = []
-    last_added_line = candidate_lines_with_pos[0][1]
-    final_lines.append(get_text(last_added_line.layout.text_anchor, document_text).strip())
-    for i in range(1, len(candidate_lines_with_pos)):
-        current_line = candidate_lines_with_pos[i][1]
-        last_bottom_y = max(v.y for v in last_added_line.layout.bounding_poly.normalized_vertices)
-        current_top_y = min(v.y for v in current_line.layout.bounding_poly.normalized_vertices)
-        if (current_top_y - last_bottom_y) > vertical_gap_threshold:
+    last_added_idx = candidate_idxs[0]
+    final_lines.append(index.texts[last_added_idx])
+    for current_idx in candidate_idxs[1:]:
+        if (min_y[current_idx] - max_y[last_added_idx]) > vertical_gap_threshold:
             print("Detected large vertical gap. Stopping Banking Details search.")
             break
-        final_lines.append(get_text(current_line.layout.text_anchor, document_text).strip())
-        last_added_line = current_line
+        final_lines.append(index.texts[current_idx])
+        last_added_idx = current_idx
 
     return "\n".join(final_lines)
 
 
-def extract_banking_details(document: dict) -> Optional[str]:
+# Lines that identify the banking block when there is no 'Banking Details:' header
+BANKING_KEYWORDS = ("account name", "account number", "swift address", "branch name", "branch code")
+# Any keyword as a substring of the lowercased line, in one scan
+_BANKING_KEYWORDS_RE = re.compile("|".join(map(re.escape, BANKING_KEYWORDS)))
+
+
+def extract_banking_details(document: dict, page_index: Optional[PageIndex] = None) -> Optional[str]:
     """
     It first tries a header search. If that fails,
     it finds all banking keywords to define a precise column, then performs a
     bi-directional gap analysis within that column to assemble the full block.
     """
-    if not document.pages:
+    index = page_index_for(document, page_index)
+    if index is None:
         return None
-    page = document.pages[0]
-    document_text = document.text
 
     # Strategy 1: The Fast Path (Header Search)
     print("\n--- Extracting Banking Details ---")
     print("Trying Strategy 1: Searching for 'Banking Details:' header...")
     try:
         # Assuming _extract_banking_details_by_header exists from a previous step.
-        details = _extract_banking_details_by_header(document)
+        details = _extract_banking_details_by_header(document, index)
         if details:
             print("SUCCESS: Found details using header anchor.")
             return details
@@ -503,66 +601,58 @@ def extract_banking_details(document: dict) -> Optional[str]:
     # Strategy 2: The Fallback (Precise Column + Gap Analysis)
     print("Header not found. Trying Strategy 2: Precise column search with gap analysis...")
     
-    BANKING_KEYWORDS = ["account name", "account number", "swift address", "branch name", "branch code"]
-    
     # 1. Find ALL lines that contain any of our keywords.
-    anchor_lines = [
-        line for line in page.lines
-        if any(keyword in get_text(line.layout.text_anchor, document_text).lower() for keyword in BANKING_KEYWORDS)
-    ]
+    anchor_idxs = [i for i, text_lower in enumerate(index.texts_lower) if _BANKING_KEYWORDS_RE.search(text_lower)]
 
-    if not anchor_lines:
+    if not anchor_idxs:
         print("Could not find any banking keywords to use as anchors.")
         return None
     
-    print(f"Found {len(anchor_lines)} banking keyword anchor lines to define the column.")
+    print(f"Found {len(anchor_idxs)} banking keyword anchor lines to define the column.")
 
     # 2. Define a PRECISE column based on the collective width of the anchor lines.
-    column_left_x = min(min(v.x for v in line.layout.bounding_poly.normalized_vertices) for line in anchor_lines) - 0.02
-    column_right_x = max(max(v.x for v in line.layout.bounding_poly.normalized_vertices) for line in anchor_lines) + 0.02
+    column_left_x = index.min_x[anchor_idxs].min() - 0.02
+    column_right_x = index.max_x[anchor_idxs].max() + 0.02
 
     # 3. Gather all lines on the page that fall within this precise column.
-    candidate_lines = [
-        line for line in page.lines
-        if column_left_x < ((min(v.x for v in line.layout.bounding_poly.normalized_vertices) + max(v.x for v in line.layout.bounding_poly.normalized_vertices)) / 2.0) < column_right_x
-    ]
+    candidate_idxs = np.flatnonzero((column_left_x < index.cx) & (index.cx < column_right_x)).tolist()
     
-    if not candidate_lines:
+    if not candidate_idxs:
         return None
 
     # 4. Sort candidates and find a "seed" anchor to start our search from.
-    candidate_lines.sort(key=lambda l: min(v.y for v in l.layout.bounding_poly.normalized_vertices))
-    seed_anchor_line = anchor_lines[0] # The first one we found is a good starting point.
+    min_y, max_y = index.min_y, index.max_y
+    candidate_idxs = sort_by_top(index, candidate_idxs)
+    seed_idx = anchor_idxs[0] # The first one we found is a good starting point.
     
     try:
-        start_index = candidate_lines.index(seed_anchor_line)
+        start_index = candidate_idxs.index(seed_idx)
     except ValueError:
         print("Seed anchor was not found in the filtered candidate list. Aborting.")
         return None
 
     # 5. Perform the bi-directional search with gap analysis on the pre-filtered candidates.
-    final_block_lines = [seed_anchor_line]
+    final_block_idxs = [seed_idx]
     vertical_gap_threshold = 0.02
 
     # Search upwards from the seed
     for i in range(start_index - 1, -1, -1):
-        current_line, line_below = candidate_lines[i], candidate_lines[i+1]
-        if (min(v.y for v in line_below.layout.bounding_poly.normalized_vertices) - max(v.y for v in current_line.layout.bounding_poly.normalized_vertices)) > vertical_gap_threshold:
+        current_idx, below_idx = candidate_idxs[i], candidate_idxs[i+1]
+        if (min_y[below_idx] - max_y[current_idx]) > vertical_gap_threshold:
             break
-        final_block_lines.append(current_line)
+        final_block_idxs.append(current_idx)
     
     # Search downwards from the seed
-    last_added_line_in_downward_search = seed_anchor_line
-    for i in range(start_index + 1, len(candidate_lines)):
-        current_line = candidate_lines[i]
-        if (min(v.y for v in current_line.layout.bounding_poly.normalized_vertices) - max(v.y for v in last_added_line_in_downward_search.layout.bounding_poly.normalized_vertices)) > vertical_gap_threshold:
+    last_added_idx_in_downward_search = seed_idx
+    for i in range(start_index + 1, len(candidate_idxs)):
+        current_idx = candidate_idxs[i]
+        if (min_y[current_idx] - max_y[last_added_idx_in_downward_search]) > vertical_gap_threshold:
             break
-        final_block_lines.append(current_line)
-        last_added_line_in_downward_search = current_line
+        final_block_idxs.append(current_idx)
+        last_added_idx_in_downward_search = current_idx
         
     # 6. Final Assembly
-    final_block_lines.sort(key=lambda l: min(v.y for v in l.layout.bounding_poly.normalized_vertices))
+    final_block_idxs = sort_by_top(index, final_block_idxs)
     
     print("SUCCESS: Assembled banking details block using precise column and gap analysis.")
-    return "\n".join([get_text(l.layout.text_anchor, document_text).strip() for l in final_block_lines])
-
+    return "\n".join([index.texts[i] for i in final_block_idxs])
@@ -5,7 +5,7 @@ from extractors.PL_extractor import extract_pl_data
 from extractors.phyto_extractor import extract_phyto_data
 from extractors.COO_extractor import extract_coo_data
 from extractors.EUR1_extractor import extract_eur1_data
-from extractors.BOL_extractor import extract_bol_data
+from extractors.BOL_extractor import extract_bol_data, BOL_FIELD_MASK
 from processors.pdf_pre_processor import preprocess_pdf_for_ocr
 from processors.json_formatter import build_text_from_raw_layout, consolidate_extractions
 from extractors.BOL_agent_extractor import run_bol_extraction_agent
@@ -13,7 +13,6 @@ from extractors.PL_extractor import extract_pl_data
 from extractors.PPECB_extractor import extract_ppecb_data
 from typing import Dict, Any, Optional
 import streamlit as st
-from google.oauth2 import service_account
 
 
 load_dotenv()
@@ -24,6 +23,19 @@ form_processor_id = st.secrets["app_config"]["form_processor_id"]
 layout_processor_id = st.secrets["app_config"]["layout_processor_id"]
 
 
+class IncompleteExtractionError(Exception):
+    """
+    Raised by run_extraction_for_document(require_complete=True) when a step
+    failed, so callers that cache results can skip caching them. `result`
+    holds whatever was still extracted (possibly None).
+    """
+
+    def __init__(self, doc_type_key: str, result: Optional[Dict[str, Any]] = None):
+        super().__init__(f"Extraction for '{doc_type_key}' did not complete.")
+        self.doc_type_key = doc_type_key
+        self.result = result
+
+
 def run_extraction_for_document(
     doc_type_key: str,
     file_bytes: bytes,
@@ -31,11 +43,34 @@ def run_extraction_for_document(
     location: str,
     form_processor_id: str,
     layout_processor_id: str,
+    require_complete: bool = False,
 ) -> Optional[Dict[str, Any]]:
     """
     Selects and runs the correct extraction workflow based on the document type.
     This is the single entry point for the Streamlit UI.
+
+    With require_complete=True, a missing result or a BOL whose layout/agent
+    step failed raises IncompleteExtractionError instead of being returned.
     """
+    result = _run_extraction_workflow(
+        doc_type_key, file_bytes, project_id, location, form_processor_id, layout_processor_id,
+        require_complete=require_complete,
+    )
+    if require_complete and result is None:
+        raise IncompleteExtractionError(doc_type_key)
+    return result
+
+
+def _run_extraction_workflow(
+    doc_type_key: str,
+    file_bytes: bytes,
+    project_id: str,
+    location: str,
+    form_processor_id: str,
+    layout_processor_id: str,
+    require_complete: bool = False,
+) -> Optional[Dict[str, Any]]:
+    """Runs the extraction workflow for one document type (see run_extraction_for_document)."""
     print(f"[ENGINE] Received request to extract document type: '{doc_type_key}'")
     
     if doc_type_key == "commercial_invoice":
@@ -54,7 +89,8 @@ def run_extraction_for_document(
             location=location,
             processor_id=form_processor_id, 
             content_bytes=file_bytes,
-            mime_type="application/pdf"
+            mime_type="application/pdf",
+            field_mask=BOL_FIELD_MASK
         )
         initial_extracted = extract_bol_data(document_object)
         agent_document = process_document_sample(
@@ -69,6 +105,9 @@ def run_extraction_for_document(
             ocr_text=text_doc
         )
         final_result = consolidate_extractions(initial_extracted, agent_extraction)
+        if require_complete and (agent_document is None or agent_extraction is None):
+            # The agent-only fields are missing; don't let this result be cached
+            raise IncompleteExtractionError(doc_type_key, final_result)
         return final_result 
 
     elif doc_type_key == "phyto_certificate":
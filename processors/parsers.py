@@ -5,6 +5,7 @@ from google.cloud import documentai
 #from processors.google_helper import create_keyfile_dict
 from google.oauth2 import service_account
 from google.cloud.documentai_v1.types import Document
+from google.protobuf import field_mask_pb2
 import streamlit as st
 
 
@@ -69,11 +70,15 @@ def process_document_sample(
     location: str,
     processor_id: str,
     content_bytes: bytes, 
-    mime_type: str = "application/pdf"
+    mime_type: str = "application/pdf",
+    field_mask: Optional[str] = None,
 ) -> Optional[documentai.Document]:
     """
     Processes a document using the Document AI Layout Parser.
     This version takes bytes directly and makes a robust request.
+
+    field_mask is an optional comma-separated list of Document fields to return
+    (top-level or `pages.<field>`), so callers can skip output they never read.
     """
     logger.info("Starting robust document processing...")
 
@@ -89,6 +94,7 @@ def process_document_sample(
         request = documentai.ProcessRequest(
             name=name,
             raw_document=raw_document,
+            field_mask=field_mask_pb2.FieldMask(paths=field_mask.split(",")) if field_mask else None,
         )
 
         logger.info(f"Sending request to processor: {name}")
@@ -18,13 +18,14 @@ class ValidationStatus:
     NOT_APPLICABLE = "NOT_APPLICABLE"                
 
 # Define which fields get special handling
-MULTI_LINE_FIELDS = ["exporter_address", "consignee_details", "notify_party_details", "invoice_party_details", "banking_details"]
-INTEGER_FIELDS = ["total_cartons"]
-FLOAT_FIELDS = ["total_gross_mass_kg", "total_net_mass_kg"]
-CURRENCY_FIELDS = ["total_value"]
-CONTAINER_FIELDS = ["container_number"]
-SIMPLE_TEXT_FIELDS = ["vessel_name", "voyage", "port_of_destination"]
-PARTIAL_MATCH_FIELDS = ["port_of_destination"]
+# (frozensets, since these are only ever used for membership checks)
+MULTI_LINE_FIELDS = frozenset(["exporter_address", "consignee_details", "notify_party_details", "invoice_party_details", "banking_details"])
+INTEGER_FIELDS = frozenset(["total_cartons"])
+FLOAT_FIELDS = frozenset(["total_gross_mass_kg", "total_net_mass_kg"])
+CURRENCY_FIELDS = frozenset(["total_value"])
+CONTAINER_FIELDS = frozenset(["container_number"])
+SIMPLE_TEXT_FIELDS = frozenset(["vessel_name", "voyage", "port_of_destination"])
+PARTIAL_MATCH_FIELDS = frozenset(["port_of_destination"])
 
 # --- NEW: VALIDATION PROFILES ---
 # Define which fields are expected for each document type.